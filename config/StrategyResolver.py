@@ -1,20 +1,97 @@
-from brownie import interface
+from helpers.invariants import After, Before, Param, Rule, RuleSet
 from helpers.StrategyCoreResolver import StrategyCoreResolver
 from rich.console import Console
 
 console = Console()
 
+valueGained = After("sett.pricePerFullShare") > Before("sett.pricePerFullShare")
+
+HOOK_RULES = {
+    ## Check that balance in gauge goes down
+    "withdraw": RuleSet(
+        Rule(
+            "gauge want decreases",
+            Before.balances("want", "gauge") > After.balances("want", "gauge"),
+            when=Param("amount") > 0,
+        )
+    ),
+    ## Check that balance in gauge goes up
+    "deposit": RuleSet(
+        Rule(
+            "sett want increases",
+            After.balances("want", "sett") > Before.balances("want", "sett"),
+        )
+    ),
+    ## Check that balance in gauge goes up
+    "earn": RuleSet(
+        Rule(
+            "gauge want increases",
+            After.balances("want", "gauge") > Before.balances("want", "gauge"),
+            when=Before.balances("want", "sett") > 1,
+        )
+    ),
+}
+
+HARVEST_RULES = RuleSet(
+    # Strategist should earn if fee is enabled and value was generated
+    Rule(
+        "strategist earns fees",
+        After.balances("want", "strategist") > Before.balances("want", "strategist"),
+        when=(Before("strategy.performanceFeeStrategist") > 0) & valueGained,
+    ),
+    # Governance should earn if fee is enabled and value was generated
+    Rule(
+        "governance earns fees",
+        After.balances("want", "governanceRewards")
+        > Before.balances("want", "governanceRewards"),
+        when=(Before("strategy.performanceFeeGovernance") > 0) & valueGained,
+    ),
+    ## Check that balance in tree goes up
+    Rule(
+        "tree receives rewards",
+        After.balances("reward", "badgerTree")
+        > Before.balances("reward", "badgerTree"),
+    ),
+)
+
+TEND_RULES = RuleSet(
+    # Check that balance of want on strategy goes to 0 after tend
+    Rule("want leaves the strategy", After("strategy.balanceOfWant") == 0),
+    # Amount deposited in pool must have increased
+    Rule(
+        "pool grows",
+        After("strategy.balanceOfPool") > Before("strategy.balanceOfPool"),
+    ),
+    # Tend only produces results if balance of want in strategy is > 0
+    when=Before("strategy.balanceOfWant") > 0,
+)
+
 
 class StrategyResolver(StrategyCoreResolver):
+    metadataCalls = {
+        "gauge": "gauge()(address)",
+        "badgerTree": "badgerTree()(address)",
+        "reward": "reward()(address)",
+    }
+    # setGauge moves the funds to a new gauge
+    watchedMetadata = ("gauge",)
+
+    actionRules = {
+        **StrategyCoreResolver.actionRules,
+        "harvest": HARVEST_RULES,
+        "tend": TEND_RULES,
+    }
+    hookRules = HOOK_RULES
+
     def get_strategy_destinations(self):
         """
         Track balances for all strategy implementations
         (Strategy Must Implement)
         """
-        strategy = self.manager.strategy
+        metadata = self.get_metadata()
         return {
-            "gauge": strategy.gauge(),
-            "badgerTree": strategy.badgerTree(),
+            "gauge": metadata["gauge"],
+            "badgerTree": metadata["badgerTree"],
         }
 
     def hook_after_confirm_withdraw(self, before, after, params):
@@ -22,24 +99,21 @@ class StrategyResolver(StrategyCoreResolver):
         Specifies extra check for ordinary operation on withdrawal
         Use this to verify that balances in the get_strategy_destinations are properly set
         """
-        ## Check that balance in gauge goes down
-        assert before.balances("want", "gauge") > after.balances("want", "gauge")
+        self.hookRules["withdraw"].verify(before, after, params)
 
     def hook_after_confirm_deposit(self, before, after, params):
         """
         Specifies extra check for ordinary operation on deposit
         Use this to verify that balances in the get_strategy_destinations are properly set
         """
-        ## Check that balance in gauge goes up
-        assert after.balances("want", "sett") > before.balances("want", "sett")
+        self.hookRules["deposit"].verify(before, after, params)
 
     def hook_after_earn(self, before, after, params):
         """
         Specifies extra check for ordinary operation on earn
         Use this to verify that balances in the get_strategy_destinations are properly set
         """
-        ## Check that balance in gauge goes up
-        assert after.balances("want", "gauge") > before.balances("want", "gauge")
+        self.hookRules["earn"].verify(before, after, params)
 
     def confirm_harvest(self, before, after, tx):
         """
@@ -48,25 +122,7 @@ class StrategyResolver(StrategyCoreResolver):
         console.print("=== Compare Harvest ===")
         self.manager.printCompare(before, after)
         self.confirm_harvest_state(before, after, tx)
-
-        valueGained = after.get("sett.pricePerFullShare") > before.get(
-            "sett.pricePerFullShare"
-        )
-
-        # Strategist should earn if fee is enabled and value was generated
-        if before.get("strategy.performanceFeeStrategist") > 0 and valueGained:
-            assert after.balances("want", "strategist") > before.balances(
-                "want", "strategist"
-            )
-
-        # Strategist should earn if fee is enabled and value was generated
-        if before.get("strategy.performanceFeeGovernance") > 0 and valueGained:
-            assert after.balances("want", "governanceRewards") > before.balances(
-                "want", "governanceRewards"
-            )
-
-        ## Check that balance in tree goes up
-        assert after.balances("reward", "badgerTree") > before.balances("reward", "badgerTree")
+        self.actionRules["harvest"].verify(before, after)
 
     def confirm_tend(self, before, after, tx):
         """
@@ -78,24 +134,15 @@ class StrategyResolver(StrategyCoreResolver):
         """
         console.print("=== Compare Tend ===")
         self.manager.printCompare(before, after)
-        # Tend only produces results if balance of want in strategy is > 0
-        if before.get("strategy.balanceOfWant") > 0:
-            # Check that balance of want on strategy goes to 0 after tend
-            assert after.get("strategy.balanceOfWant") == 0
-
-            # Amount deposited in pool must have increased
-            assert after.get("strategy.balanceOfPool") > before.get(
-                "strategy.balanceOfPool"
-            )
+        self.actionRules["tend"].verify(before, after)
 
     def add_balances_snap(self, calls, entities):
         """
             Add tracking for reward
         """
         super().add_balances_snap(calls, entities)
-        strategy = self.manager.strategy
 
-        reward = interface.IERC20(strategy.reward())
+        reward = self.token(self.get_metadata()["reward"])
 
         calls = self.add_entity_balances_for_tokens(calls, "reward", reward, entities)
 
@@ -0,0 +1,111 @@
+import logging
+
+from brownie import *
+
+from helpers.multicall import Call, Multicall
+from helpers.multicall.metrics import get_metrics
+from helpers.snapshot.snap import KeyIndex, Snap
+from helpers.SnapshotManager import SnapshotManager, discover
+
+logger = logging.getLogger(__name__)
+
+
+class FleetManager:
+    """
+    Snapshots many (sett, strategy, controller) triples at once: their call plans are merged
+    into one chunked plan and each snap is split back per vault, into the vault's own
+    SnapshotManager history
+    """
+
+    # Passed through to Multicall, chunks keep each eth_call under node gas caps
+    multicallOptions = {"max_calls": 250}
+
+    def __init__(self, vaults):
+        """
+        vaults: {key: (sett, strategy, controller)}, init-time reads and every resolver's
+        metadata are batched by discover() across the fleet
+        """
+        metadata = discover(vaults, **self.multicallOptions)
+        self.managers = {
+            key: SnapshotManager(sett, strategy, controller, key, metadata[key])
+            for key, (sett, strategy, controller) in vaults.items()
+        }
+        self.plan = None
+        self.planKey = None
+        # key -> (start, end, KeyIndex, entityKeys) of the vault's values in the plan
+        self.slices = {}
+
+    def __getitem__(self, key) -> SnapshotManager:
+        return self.managers[key]
+
+    def get_plan(self):
+        """
+        Merged call plan, rebuilt when any vault's entities, resolver or metadata change
+        """
+        planKey = tuple(
+            (
+                key,
+                manager.resolver,
+                manager.planVersion,
+                tuple(manager.entities.items()),
+            )
+            for key, manager in self.managers.items()
+        )
+        if self.plan is None or self.planKey != planKey:
+            calls = []
+            for key, manager in self.managers.items():
+                for call in manager.add_snap_calls(manager.entities):
+                    # Namespace each return by vault so keys do not collide
+                    calls.append(
+                        Call(
+                            call.target,
+                            [call.function, *(call.args or [])],
+                            [
+                                [(key, name), handler]
+                                for name, handler in call.returns or []
+                            ],
+                        )
+                    )
+            self.plan = Multicall(calls, **self.multicallOptions).compile()
+            self.planKey = planKey
+
+            # Keys come out in call order, so each vault's keys are one contiguous slice
+            self.slices = {}
+            for position, (key, name) in enumerate(self.plan.keys):
+                if key not in self.slices:
+                    self.slices[key] = [position, position, []]
+                elif self.slices[key][1] != position:
+                    raise ValueError("keys of vault {} are not contiguous".format(key))
+                self.slices[key][1] = position + 1
+                self.slices[key][2].append(name)
+            for key, (start, end, names) in self.slices.items():
+                self.slices[key] = (
+                    start,
+                    end,
+                    KeyIndex.intern(names),
+                    list(self.managers[key].entities.keys()),
+                )
+            logger.info(
+                f"compiled fleet plan: {len(self.managers)} vaults, {len(self.plan)} calls, "
+                f"{len(self.plan.chunks)} chunks, {self.plan.saved} duplicates saved"
+            )
+        return self.plan
+
+    def snap(self, block=None):
+        """
+        {key: Snap} for every vault at `block`, defaults to the current chain height
+        """
+        snapBlock = chain.height if block is None else block
+        for manager in self.managers.values():
+            manager.expire_metadata(snapBlock)
+        with get_metrics().timer("fleet.snap_ms"):
+            values = self.get_plan().values(block_identifier=snapBlock)
+
+        snaps = {}
+        for key, (start, end, index, entityKeys) in self.slices.items():
+            snap = Snap.from_values(index, values[start:end], snapBlock, entityKeys)
+            self.managers[key].snaps.put(snap)
+            # Moved metadata or destinations change the vault's plan, the fleet's follows
+            self.managers[key].watch_metadata(snap)
+            snaps[key] = snap
+        return snaps
@@ -0,0 +1,84 @@
+"""
+Resolver classes by strategy getName() and version().
+
+Entries point at "module:Class" and are imported on first use, so a fleet monitor only
+loads the resolvers of the strategies it actually watches. Unknown strategies get
+GenericResolver: core snap calls and checks, no strategy specific destinations or hooks.
+
+    resolvers.register("my-Strategy-Name", "config.MyResolver:MyResolver", version="1.0")
+"""
+
+import importlib
+import logging
+
+from helpers.StrategyCoreResolver import StrategyCoreResolver
+
+logger = logging.getLogger(__name__)
+
+
+class GenericResolver(StrategyCoreResolver):
+    """
+    Fallback for strategies without a registered resolver
+    """
+
+    def get_strategy_destinations(self):
+        return {}
+
+    def hook_after_confirm_withdraw(self, before, after, params):
+        pass
+
+    def hook_after_confirm_deposit(self, before, after, params):
+        pass
+
+    def hook_after_earn(self, before, after, params):
+        pass
+
+    def confirm_tend(self, before, after, tx):
+        self.manager.printCompare(before, after)
+
+
+class ResolverRegistry:
+    def __init__(self, fallback="helpers.ResolverRegistry:GenericResolver"):
+        # (name, version) -> "module:Class" or class, version None matches any version
+        self.entries = {}
+        self.fallback = fallback
+
+    def register(self, name, target, version=None):
+        self.entries[(name, version)] = target
+
+    def versioned(self, name):
+        return any(key == name and version is not None for key, version in self.entries)
+
+    def resolve(self, name, version=None):
+        """
+        Resolver class for a strategy. `version` may be a callable, it is only called when
+        the name has version specific entries
+        """
+        if callable(version):
+            try:
+                version = version() if self.versioned(name) else None
+            except Exception:
+                # Older implementations may not have version()
+                version = None
+        for key in ((name, version), (name, None)):
+            if key in self.entries:
+                self.entries[key] = load(self.entries[key])
+                return self.entries[key]
+        logger.warning(f"no resolver for {name} {version or ''}, using the generic one")
+        self.fallback = load(self.fallback)
+        return self.fallback
+
+
+def load(target):
+    if not isinstance(target, str):
+        return target
+    module, attribute = target.split(":")
+    return getattr(importlib.import_module(module), attribute)
+
+
+resolvers = ResolverRegistry()
+# Every implementation so far, register a version only once one needs its own resolver:
+# versioned names cost a version() read per vault at init
+resolvers.register(
+    "triCrypto-Curve-Arbitrum-Rewards", "config.StrategyResolver:StrategyResolver"
+)
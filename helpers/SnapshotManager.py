@@ -1,37 +1,182 @@
 import logging
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
 
 from brownie import *
 from tabulate import tabulate
 
-from config.StrategyResolver import StrategyResolver
-from helpers.multicall import Multicall
-from helpers.snapshot.snap import Snap
+from helpers.multicall import Call, CallFailure, Multicall, func
+from helpers.multicall.metrics import get_metrics
+from helpers.ResolverRegistry import resolvers
+from helpers.snapshot.diff import SnapDiff, render
+from helpers.snapshot.events import EventSourcedSnaps
+from helpers.snapshot.history import SnapHistory
+from helpers.snapshot.report import Lazy, as_json, compare_report, snap_report
+from helpers.snapshot.snap import KeyIndex, Snap
 from helpers.utils import val
 
 logger = logging.getLogger(__name__)
 
 
+def tagged(fn):
+    """
+    Attribute every RPC made while fn runs to its name in the metrics
+    """
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        with get_metrics().tag(fn.__name__):
+            return fn(*args, **kwargs)
+
+    return wrapper
+
+
+def hash_bytes(blockHash):
+    """
+    Block hashes come as HexBytes from web3 blocks, bytes from tryBlockAndAggregate
+    """
+    if isinstance(blockHash, str):
+        return bytes.fromhex(blockHash[2:] if blockHash.startswith("0x") else blockHash)
+    return bytes(blockHash)
+
+
+def discover(vaults, **multicallOptions):
+    """
+    Init-time reads of every vault in one multicall, as SnapshotManager metadata
+    vaults: {key: (sett, strategy, controller)}
+
+    version() is only read for strategies with version specific resolvers, in a second
+    tryAggregate so implementations without it come back as None. The metadataCalls of
+    every vault's resolver are then read together, as "resolverMetadata"
+    """
+    calls = []
+    for key, (sett, strategy, controller) in vaults.items():
+        calls += [
+            Call(sett.address, [func.sett.token], [[(key, "want"), None]]),
+            Call(
+                strategy.address, [func.strategy.want], [[(key, "strategyWant"), None]]
+            ),
+            Call(strategy.address, [func.strategy.getName], [[(key, "name"), None]]),
+            Call(
+                strategy.address,
+                [func.strategy.governance],
+                [[(key, "governance"), None]],
+            ),
+            Call(
+                strategy.address,
+                [func.strategy.strategist],
+                [[(key, "strategist"), None]],
+            ),
+            Call(
+                controller.address,
+                [func.controller.rewards],
+                [[(key, "rewards"), None]],
+            ),
+        ]
+    metadata = {key: {} for key in vaults}
+    for (key, name), value in Multicall(calls, **multicallOptions)().items():
+        metadata[key][name] = value
+
+    calls = [
+        Call(strategy.address, [func.strategy.version], [[(key, "version"), None]])
+        for key, (sett, strategy, controller) in vaults.items()
+        if resolvers.versioned(metadata[key]["name"])
+    ]
+    if calls:
+        options = {**multicallOptions, "require_success": False}
+        for (key, name), value in Multicall(calls, **options)().items():
+            metadata[key][name] = None if isinstance(value, CallFailure) else value
+
+    calls = []
+    for key, (sett, strategy, controller) in vaults.items():
+        resolver = resolvers.resolve(
+            metadata[key]["name"], metadata[key].get("version")
+        )
+        metadata[key]["resolverMetadata"] = {}
+        calls += [
+            Call(strategy.address, [signature], [[(key, name), None]])
+            for name, signature in resolver.metadataCalls.items()
+        ]
+    block = None
+    if calls:
+        plan = Multicall(calls, **multicallOptions).compile()
+        for (key, name), value in plan().items():
+            metadata[key]["resolverMetadata"][name] = value
+        block = plan.block
+    for key in vaults:
+        metadata[key]["metadataBlock"] = block
+    return metadata
+
+
 class SnapshotManager:
-    def __init__(self, sett, strategy, controller, key):
+    # Passed through to Multicall, e.g. {"require_success": False, "max_calls": 200}
+    multicallOptions = {}
+    # Keep raw multicall outputs and decode each field on first read
+    lazySnaps = False
+    # Snaps between two full copies in the history, the rest are stored as deltas
+    keyframeInterval = 32
+    # Reports are logged as "table" for people or "json" for machines
+    reportFormat = "table"
+    # Snaps after a transaction are rebuilt from its Transfer logs, with a full multicall
+    # every `verifyEvery` transactions to catch drift
+    eventSourced = False
+    verifyEvery = 10
+    # Compiled plans kept, one per entity scope
+    maxPlans = 16
+
+    def __init__(self, sett, strategy, controller, key, metadata=None):
+        """
+        metadata holds the init-time reads (want, strategyWant, name, governance, rewards,
+        strategist and the resolver's metadata), read here by discover() unless already
+        batched by FleetManager
+        """
+        if metadata is None:
+            metadata = discover(
+                {key: (sett, strategy, controller)}, **self.multicallOptions
+            )[key]
+
+        def known(name, read):
+            return metadata[name] if name in metadata else read()
+
         self.key = key
         self.sett = sett
         self.strategy = strategy
         self.controller = controller
-        self.want = interface.IERC20(self.sett.token())
-        self.resolver = self.init_resolver(self.strategy.getName())
-        self.snaps = {}
+        self.want = interface.IERC20(known("want", self.sett.token))
+        self.resolver = self.init_resolver(
+            known("name", self.strategy.getName),
+            lambda: known("version", self.strategy.version),
+        )
+        resolverMetadata = metadata.get("resolverMetadata")
+        if resolverMetadata is not None and set(resolverMetadata) == set(
+            self.resolver.metadataCalls
+        ):
+            self.resolver.set_metadata(resolverMetadata, metadata.get("metadataBlock"))
+        self.snaps = SnapHistory(self.keyframeInterval)
         self.settSnaps = {}
         self.entities = {}
-
-        assert self.want == self.strategy.want()
+        self.plans = OrderedDict()
+        self.plan = None
+        self.planKey = None
+        # Bumped whenever the plans are dropped, FleetManager recompiles on a change
+        self.planVersion = 0
+        self.keyIndex = None
+        self.entityKeys = None
+        self.inSequence = 0
+        self.boundary = None
+        self.events = None
+        self.eventsKey = None
+
+        assert self.want == known("strategyWant", self.strategy.want)
 
         # Common entities for all strategies
         self.addEntity("sett", self.sett.address)
         self.addEntity("strategy", self.strategy.address)
         self.addEntity("controller", self.controller.address)
-        self.addEntity("governance", self.strategy.governance())
-        self.addEntity("governanceRewards", self.controller.rewards())
-        self.addEntity("strategist", self.strategy.strategist())
+        self.addEntity("governance", known("governance", self.strategy.governance))
+        self.addEntity("governanceRewards", known("rewards", self.controller.rewards))
+        self.addEntity("strategist", known("strategist", self.strategy.strategist))
 
         destinations = self.resolver.get_strategy_destinations()
         for key, dest in destinations.items():
@@ -43,107 +188,276 @@ class SnapshotManager:
         calls = self.resolver.add_sett_snap(calls)
         # calls = self.resolver.add_sett_permissions_snap(calls)
         calls = self.resolver.add_strategy_snap(calls, entities=entities)
+        calls = self.resolver.add_metadata_snap(calls)
         return calls
 
-    def snap(self, trackedUsers=None):
+    def refresh_destinations(self):
+        for key, dest in self.resolver.get_strategy_destinations().items():
+            if self.entities.get(key) != dest:
+                self.addEntity(key, dest)
+
+    def expire_metadata(self, block):
+        """
+        Re-read resolver metadata and destinations once past the resolver's metadataTTL,
+        plans are recompiled if the metadata moved
+        """
+        if self.resolver.metadata_stale(block):
+            metadata = self.resolver.metadata
+            self.resolver.invalidate_metadata()
+            if self.resolver.get_metadata() != metadata:
+                self.invalidate_plan()
+            self.refresh_destinations()
+
+    def watch_metadata(self, snap: Snap):
+        """
+        Re-read resolver metadata and destinations when a watched value moved in the snap
+        """
+        if self.resolver.metadata_changed(snap):
+            logger.info("strategy metadata changed at block %s", snap.block)
+            # Snap calls are built from the metadata, e.g. the reward token balances
+            self.invalidate_plan()
+            self.refresh_destinations()
+
+    def get_plan(self, entities):
+        """
+        Compiled call plan for the entity scope, plans are cached per scope so alternating
+        between tracked users does not recompile
+        """
+        planKey = (self.resolver, tuple(entities.items()))
+        if self.planKey != planKey:
+            cached = self.plans.pop(planKey, None)
+            if cached is None:
+                calls = self.add_snap_calls(entities)
+                plan = Multicall(calls, **self.multicallOptions).compile()
+                cached = (plan, KeyIndex.intern(plan.keys), list(entities.keys()))
+                logger.info(
+                    f"compiled plan: {len(plan)} calls, {plan.saved} duplicates saved"
+                )
+            self.plans[planKey] = cached
+            while len(self.plans) > self.maxPlans:
+                self.plans.popitem(last=False)
+            self.plan, self.keyIndex, self.entityKeys = cached
+            self.planKey = planKey
+        return self.plan
+
+    def invalidate_plan(self):
+        self.plans.clear()
+        self.plan = None
+        self.planKey = None
+        self.events = None
+        self.planVersion += 1
+
+    @contextmanager
+    def sequence(self):
+        """
+        Steps run inside share boundary snaps: while the chain has not moved (same height
+        and block hash) and the entities are the same, a step's before-snap is the previous
+        step's after-snap instead of a new multicall. Every confirm_* still runs
+
+            with snap.sequence():
+                snap.settDeposit(amount, {"from": user})
+                snap.settEarn({"from": keeper})
+        """
+        self.inSequence += 1
+        try:
+            yield self
+        finally:
+            self.inSequence -= 1
+            if not self.inSequence:
+                self.boundary = None
+
+    def boundary_scope(self, entities):
+        return (self.resolver, tuple(entities.items()))
+
+    def set_boundary(self, snap: Snap, entities, blockHash):
+        self.boundary = (snap.block, blockHash, self.boundary_scope(entities), snap)
+
+    def reusable(self, block, entities):
+        """
+        The boundary snap if it was taken at `block` over the same entities and the block
+        still has the same hash. The node is only asked for the hash when the height and
+        scope match. A boundary read without a hash (anything but tryBlockAndAggregate)
+        takes the first hash fetched for its block, later reuses are checked against it
+        """
+        if self.boundary is None:
+            return None
+        boundaryBlock, blockHash, scope, snap = self.boundary
+        if boundaryBlock != block or scope != self.boundary_scope(entities):
+            return None
+        currentHash = hash_bytes(web3.eth.get_block(block)["hash"])
+        if blockHash is None:
+            self.boundary = (boundaryBlock, currentHash, scope, snap)
+        elif hash_bytes(blockHash) != currentHash:
+            return None
+        return snap
+
+    def scope(self, trackedUsers=None):
+        """
+        Base entities plus the ephemeral ones of this call, self.entities is left untouched
+        """
+        if not trackedUsers:
+            return self.entities
+        return {**self.entities, **trackedUsers}
+
+    def get_events(self):
+        if self.events is None or self.eventsKey != self.planKey:
+            self.events = EventSourcedSnaps(
+                self.plan.calls, self.verifyEvery, **self.multicallOptions
+            )
+            self.eventsKey = self.planKey
+        return self.events
+
+    def after_snap(self, before: Snap, tx, trackedUsers=None):
+        """
+        Snap after `tx`: the before-snap moved by the receipt's Transfer logs when
+        eventSourced is set, a full snap otherwise
+        """
+        if not self.eventSourced or tx is None:
+            return self.snap(trackedUsers)
+        entities = self.scope(trackedUsers)
+        self.get_plan(entities)
+        if before.index is not self.keyIndex:
+            return self.snap(trackedUsers)
+
+        events = self.get_events()
+        with get_metrics().timer("snap.total_ms"):
+            snap = events.next_snap(before, tx.logs, tx.block_number)
+
+        if events.due():
+            actual = self.snap(trackedUsers, block=tx.block_number)
+            drift = events.drift(snap, actual)
+            if drift:
+                get_metrics().count("snap.drift", len(drift))
+                logger.warning(
+                    "event-sourced snap drifted at block %s: %s",
+                    tx.block_number,
+                    ", ".join(drift),
+                )
+            return actual
+
+        self.snaps.put(snap)
+        if self.inSequence:
+            self.set_boundary(snap, entities, None)
+        self.watch_metadata(snap)
+        return snap
+
+    def snap(self, trackedUsers=None, block=None):
+        """
+        Read every tracked value at `block`, defaults to the current chain height
+        """
         logger.info("snap")
-        snapBlock = chain.height
-        entities = self.entities
-
-        if trackedUsers:
-            for key, user in trackedUsers.items():
-                entities[key] = user
-
-        calls = self.add_snap_calls(entities)
-
-        multi = Multicall(calls)
-        # multi.printCalls()
-
-        data = multi()
-        self.snaps[snapBlock] = Snap(
-            data,
-            snapBlock,
-            [x[0] for x in entities.items()],
-        )
-
-        return self.snaps[snapBlock]
+        snapBlock = chain.height if block is None else block
+        self.expire_metadata(snapBlock)
+        entities = self.scope(trackedUsers)
+
+        if self.inSequence:
+            reused = self.reusable(snapBlock, entities)
+            if reused is not None:
+                get_metrics().count("snap.reused")
+                return reused
+
+        with get_metrics().timer("snap.total_ms"):
+            plan = self.get_plan(entities)
+            if self.lazySnaps:
+                values = plan.lazy_values(block_identifier=snapBlock)
+            else:
+                values = plan.values(block_identifier=snapBlock)
+        snap = Snap.from_values(self.keyIndex, values, snapBlock, self.entityKeys)
+        self.snaps.put(snap)
+        self.watch_metadata(snap)
+        if self.inSequence:
+            blockHash = plan.blockHash if plan.block == snapBlock else None
+            self.set_boundary(snap, entities, blockHash)
+
+        return snap
 
     def addEntity(self, key, entity):
         self.entities[key] = entity
+        self.invalidate_plan()
 
-    def init_resolver(self, name):
+    def init_resolver(self, name, version=None):
+        """
+        Resolver registered for the strategy, see helpers/ResolverRegistry.py
+        """
         logger.info(f"init_resolver: {name}")
-        return StrategyResolver(self)
+        return resolvers.resolve(name, version)(self)
 
+    @tagged
     def settTend(self, overrides, confirm=True):
         user = overrides["from"].address
         trackedUsers = {"user": user}
         before = self.snap(trackedUsers)
         tx = self.strategy.tend(overrides)
-        after = self.snap(trackedUsers)
+        after = self.after_snap(before, tx, trackedUsers)
         if confirm:
             self.resolver.confirm_tend(before, after, tx)
 
+    @tagged
     def settHarvest(self, overrides, confirm=True):
         user = overrides["from"].address
         trackedUsers = {"user": user}
         before = self.snap(trackedUsers)
         tx = self.strategy.harvest(overrides)
-        after = self.snap(trackedUsers)
+        after = self.after_snap(before, tx, trackedUsers)
         if confirm:
             self.resolver.confirm_harvest(before, after, tx)
 
+    @tagged
     def settDeposit(self, amount, overrides, confirm=True):
         user = overrides["from"].address
         trackedUsers = {"user": user}
         before = self.snap(trackedUsers)
-        self.sett.deposit(amount, overrides)
-        after = self.snap(trackedUsers)
+        tx = self.sett.deposit(amount, overrides)
+        after = self.after_snap(before, tx, trackedUsers)
 
         if confirm:
             self.resolver.confirm_deposit(
                 before, after, {"user": user, "amount": amount}
             )
 
+    @tagged
     def settDepositAll(self, overrides, confirm=True):
         user = overrides["from"].address
         trackedUsers = {"user": user}
         userBalance = self.want.balanceOf(user)
         before = self.snap(trackedUsers)
-        self.sett.depositAll(overrides)
-        after = self.snap(trackedUsers)
+        tx = self.sett.depositAll(overrides)
+        after = self.after_snap(before, tx, trackedUsers)
         if confirm:
             self.resolver.confirm_deposit(
                 before, after, {"user": user, "amount": userBalance}
             )
 
+    @tagged
     def settEarn(self, overrides, confirm=True):
         user = overrides["from"].address
         trackedUsers = {"user": user}
         before = self.snap(trackedUsers)
-        self.sett.earn(overrides)
-        after = self.snap(trackedUsers)
+        tx = self.sett.earn(overrides)
+        after = self.after_snap(before, tx, trackedUsers)
         if confirm:
             self.resolver.confirm_earn(before, after, {"user": user})
 
+    @tagged
     def settWithdraw(self, amount, overrides, confirm=True):
         user = overrides["from"].address
         trackedUsers = {"user": user}
         before = self.snap(trackedUsers)
         tx = self.sett.withdraw(amount, overrides)
-        after = self.snap(trackedUsers)
+        after = self.after_snap(before, tx, trackedUsers)
         if confirm:
             self.resolver.confirm_withdraw(
                 before, after, {"user": user, "amount": amount}, tx
             )
 
+    @tagged
     def settWithdrawAll(self, overrides, confirm=True):
         user = overrides["from"].address
         trackedUsers = {"user": user}
         userBalance = self.sett.balanceOf(user)
         before = self.snap(trackedUsers)
         tx = self.sett.withdraw(userBalance, overrides)
-        after = self.snap(trackedUsers)
+        after = self.after_snap(before, tx, trackedUsers)
 
         if confirm:
             self.resolver.confirm_withdraw(
@@ -171,38 +485,33 @@ class SnapshotManager:
         else:
             return "-"
 
-    def printCompare(self, before: Snap, after: Snap):
-        # self.printPermissions()
-        table = []
-        logger.info(
-            "[green]=== Compare: {} Sett {} -> {} ===[/green]".format(
-                self.key, before.block, after.block
-            )
-        )
-
-        for key, item in before.data.items():
+    def compareReport(self, before: Snap, after: Snap):
+        """
+        Structured form of printCompare: {"before", "after", "changes": {key: ...}}
+        """
+        return compare_report(SnapDiff([before, after]))
 
-            a = item
-            b = after.get(key)
-
-            # Don't add items that don't change
-            if a != b:
-                table.append(
-                    [
-                        key,
-                        self.format(key, a),
-                        self.format(key, b),
-                        self.format(key, self.diff(a, b)),
-                    ]
-                )
+    def renderCompare(self, diff: SnapDiff):
+        if self.reportFormat == "json":
+            return as_json(compare_report(diff))
+        return render(diff, format=self.format)
 
+    def printCompare(self, before: Snap, after: Snap):
+        # self.printPermissions()
+        if not logger.isEnabledFor(logging.INFO):
+            return
         logger.info(
-            tabulate(
-                table, headers=["metric", "before", "after", "diff"], tablefmt="grid"
-            )
+            "[green]=== Compare: %s Sett %s -> %s ===[/green]",
+            self.key,
+            before.block,
+            after.block,
         )
+        diff = SnapDiff([before, after])
+        logger.info("%s", Lazy(lambda: self.renderCompare(diff)))
 
     def printPermissions(self):
+        if not logger.isEnabledFor(logging.INFO):
+            return
         # Accounts
         table = []
         logger.info("[blue]=== Permissions: {} Sett ===[/blue]".format(self.key))
@@ -219,27 +528,44 @@ class SnapshotManager:
         table.append(["strategy.guardian", self.strategy.guardian()])
 
         table.append(["---------------", "--------------------"])
-        logger.info(tabulate(table, headers=["account", "value"]))
+        logger.info("%s", Lazy(lambda: tabulate(table, headers=["account", "value"])))
+
+    def renderBasics(self, snap: Snap):
+        keys = ["sett.pricePerFullShare", "balances.want.strategy"]
+        if self.reportFormat == "json":
+            return as_json(snap_report(snap, keys))
+        return tabulate(
+            [[key, snap.get(key)] for key in keys], headers=["metric", "value"]
+        )
 
     def printBasics(self, snap: Snap):
-        table = []
-        logger.info("[green]=== Status Report: {} Sett ===[green]".format(self.key))
-
-        table.append(["sett.pricePerFullShare", snap.get("sett.pricePerFullShare")])
-        table.append(["strategy.want", snap.balances("want", "strategy")])
+        logger.info("[green]=== Status Report: %s Sett ===[green]", self.key)
+        logger.info("%s", Lazy(lambda: self.renderBasics(snap)))
+
+    def tableReport(self, snap: Snap):
+        """
+        Structured form of printTable, zero balances left out
+        """
+        return snap_report(
+            snap,
+            [
+                key
+                for key, item in zip(snap.index.keys, snap.values)
+                if not ("balances" in key and item == 0)
+            ],
+        )
 
-        logger.info(tabulate(table, headers=["metric", "value"]))
+    def renderTable(self, snap: Snap):
+        report = self.tableReport(snap)
+        if self.reportFormat == "json":
+            return as_json(report)
+        table = [
+            [key, self.format(key, item)] for key, item in report["values"].items()
+        ]
+        table.append(["---------------", "--------------------"])
+        return tabulate(table, headers=["metric", "value"])
 
     def printTable(self, snap: Snap):
         # Numerical Data
-        table = []
-        logger.info("[green]=== Status Report: {} Sett ===[green]".format(self.key))
-
-        for key, item in snap.data.items():
-            # Don't display 0 balances:
-            if "balances" in key and item == 0:
-                continue
-            table.append([key, self.format(key, item)])
-
-        table.append(["---------------", "--------------------"])
-        logger.info(tabulate(table, headers=["metric", "value"]))
+        logger.info("[green]=== Status Report: %s Sett ===[green]", self.key)
+        logger.info("%s", Lazy(lambda: self.renderTable(snap)))
@@ -1,19 +1,241 @@
 from brownie import *
-from decimal import Decimal
-
-from helpers.utils import (
-    approx,
-)
 from helpers.constants import *
-from helpers.multicall import Call, as_wei, func
+from helpers.fixedpoint import deposit_shares
+from helpers.invariants import After, Before, Op, Param, Rule, RuleSet, approx
+from helpers.multicall import Call, Multicall, as_wei, func
 from rich.console import Console
 
 console = Console()
 
+# ===== Rules for ordinary operations =====
+
+settWant = Before.balances("want", "sett")
+strategyWant = Before.balances("want", "strategy")
+amount = Param("amount")
+
+EARN_RULES = RuleSet(
+    Rule("want leaves the sett", After.balances("want", "sett") <= settWant),
+    # All want should be in pool OR sitting in strategy, not a mix
+    Rule(
+        "want all in pool or all idle",
+        (
+            (After("strategy.balanceOfWant") == 0)
+            & (After("strategy.balanceOfPool") > Before("strategy.balanceOfPool"))
+        )
+        | (
+            (After("strategy.balanceOfWant") > Before("strategy.balanceOfWant"))
+            & (After("strategy.balanceOfPool") == 0)
+        ),
+    ),
+    Rule(
+        "strategy balance grows",
+        After("strategy.balanceOf") > Before("strategy.balanceOf"),
+    ),
+    Rule(
+        "user want unchanged",
+        After.balances("want", "user") == Before.balances("want", "user"),
+    ),
+    # Nothing moves if there is not enough available want in sett to transfer.
+    # NB: Since we calculate available want by taking a percentage when
+    # balance is 1 it gets rounded down to 1.
+    when=settWant > 1,
+)
+
+# Want taken from the strategy: the share of sett.balance() minus idle want in the sett
+expectedWithdraw = (
+    amount * Before("sett.balance") // Before("sett.totalSupply") - settWant
+)
+# Then idle want in the strategy, the rest comes out of the pool
+expectedFromPool = expectedWithdraw - strategyWant
+
+WITHDRAW_RULES = RuleSet(
+    Rule(
+        "no-op withdraw keeps supply",
+        After("sett.totalSupply") == Before("sett.totalSupply"),
+        when=amount == 0,
+    ),
+    Rule(
+        "no-op withdraw keeps user shares",
+        After.balances("sett", "user") == Before.balances("sett", "user"),
+        when=amount == 0,
+    ),
+    Rule(
+        "sett supply decreases",
+        After("sett.totalSupply") < Before("sett.totalSupply"),
+        when=amount > 0,
+    ),
+    Rule(
+        "user shares decrease",
+        After.balances("sett", "user") < Before.balances("sett", "user"),
+        when=amount > 0,
+    ),
+    Rule(
+        "idle want in sett decreases",
+        After.balances("want", "sett") < settWant,
+        when=(amount > 0) & (settWant > 0),
+    ),
+    # Available in the sett should decrease if want decreased
+    Rule(
+        "sett available decreases",
+        After("sett.available") <= Before("sett.available"),
+        when=(amount > 0) & (settWant > 0),
+    ),
+    # Just ensure that we have enough in the pool balance to satisfy the request
+    Rule(
+        "pool covers withdraw",
+        expectedFromPool <= Before("strategy.balanceOfPool"),
+        when=(amount > settWant) & (expectedWithdraw > strategyWant),
+    ),
+    Rule(
+        "pool pays withdraw",
+        approx(
+            Before("strategy.balanceOfPool"),
+            After("strategy.balanceOfPool") + expectedFromPool,
+            1,
+        ),
+        when=(amount > settWant) & (expectedWithdraw > strategyWant),
+    ),
+    # The total want between the strategy and sett should be less after than before
+    # if there was previous want in strategy or sett
+    Rule(
+        "idle want decreases",
+        After.balances("want", "strategy") + After.balances("want", "sett")
+        < strategyWant + settWant,
+        when=(amount > 0) & ((strategyWant > 0) | (settWant > 0)),
+    ),
+    # Fees are only processed when withdrawing from the strategy.
+    Rule(
+        "controller rewards earn fees",
+        After.balances("want", "governanceRewards")
+        > Before.balances("want", "governanceRewards"),
+        when=(amount > 0)
+        & (Before("strategy.withdrawalFee") > 0)
+        & (strategyWant > After.balances("want", "strategy")),
+    ),
+)
+
+# SettV3._deposit(): amount.mul(totalSupply()).div(pool), exact rather than through ppfs
+expectedShares = Param(
+    "expected_shares",
+    default=Op(
+        deposit_shares, amount, Before("sett.balance"), Before("sett.totalSupply")
+    ),
+)
+
+DEPOSIT_RULES = RuleSet(
+    Rule(
+        "sett supply grows by the shares",
+        approx(
+            After("sett.totalSupply"), Before("sett.totalSupply") + expectedShares, 1
+        ),
+    ),
+    Rule(
+        "want arrives in the sett",
+        approx(After.balances("want", "sett"), settWant + amount, 1),
+    ),
+    Rule(
+        "want leaves the user",
+        approx(
+            After.balances("want", "user"), Before.balances("want", "user") - amount, 1
+        ),
+    ),
+    Rule(
+        "user receives the shares",
+        approx(
+            After.balances("sett", "user"),
+            Before.balances("sett", "user") + expectedShares,
+            1,
+        ),
+    ),
+)
+
 
 class StrategyCoreResolver:
+    # Declarative checks run by confirm_*, by action
+    actionRules = {
+        "earn": EARN_RULES,
+        "withdraw": WITHDRAW_RULES,
+        "deposit": DEPOSIT_RULES,
+    }
+    # Strategy specific checks run by the hook_after_* methods, by action
+    hookRules = {}
+    # Strategy addresses the resolver depends on, {name: signature}, one multicall
+    metadataCalls = {}
+    # Metadata also read in every snap as "strategy.<name>", a change re-reads the cache
+    watchedMetadata = ()
+    # Blocks after which metadata is re-read anyway, None keeps it until it changes
+    metadataTTL = None
+
     def __init__(self, manager):
         self.manager = manager
+        self.metadata = None
+        self.metadataBlock = None
+        self.tokens = {}
+
+    # ===== Strategy metadata =====
+
+    def get_metadata(self):
+        if self.metadata is None:
+            strategy = self.manager.strategy
+            calls = [
+                Call(strategy.address, [signature], [[name, None]])
+                for name, signature in self.metadataCalls.items()
+            ]
+            if calls:
+                plan = Multicall(calls, **self.manager.multicallOptions).compile()
+                self.set_metadata(plan(), plan.block)
+            else:
+                self.set_metadata({})
+        return self.metadata
+
+    def set_metadata(self, metadata, block=None):
+        """
+        Metadata read elsewhere, e.g. by discover() for a whole fleet. Without a block
+        (tryAggregate does not return one) the TTL counts from the current height
+        """
+        self.metadata = metadata
+        if block is None and self.metadataTTL is not None:
+            block = chain.height
+        self.metadataBlock = block
+
+    def invalidate_metadata(self):
+        self.metadata = None
+        self.metadataBlock = None
+
+    def metadata_stale(self, block):
+        return (
+            self.metadataTTL is not None
+            and self.metadataBlock is not None
+            and block - self.metadataBlock >= self.metadataTTL
+        )
+
+    def add_metadata_snap(self, calls):
+        strategy = self.manager.strategy
+        for name in self.watchedMetadata:
+            # Read as uint256 so snaps stay numeric, compared against int(address)
+            signature = self.metadataCalls[name].split(")")[0] + ")(uint256)"
+            calls.append(
+                Call(strategy.address, [signature], [["strategy." + name, None]])
+            )
+        return calls
+
+    def metadata_changed(self, snap):
+        """
+        True, and the cache dropped, when a watched value in the snap differs from it
+        """
+        if self.metadata is None:
+            return False
+        for name in self.watchedMetadata:
+            key = "strategy." + name
+            if key in snap.index and snap.get(key) != int(self.metadata[name], 16):
+                self.invalidate_metadata()
+                return True
+        return False
+
+    def token(self, address):
+        if address not in self.tokens:
+            self.tokens[address] = interface.IERC20(address)
+        return self.tokens[address]
 
     # ===== Read strategy data =====
 
@@ -132,6 +354,15 @@ class StrategyCoreResolver:
     def printHarvestState(self, event, keys):
         return True
 
+    def rules(self, action):
+        """
+        Every rule checked for an action, core and strategy specific, e.g. to re-verify a
+        recorded history with RuleSet.failures(Transitions.from_pairs(...))
+        """
+        return self.actionRules.get(action, RuleSet()) + self.hookRules.get(
+            action, RuleSet()
+        )
+
     def confirm_earn(self, before, after, params):
         """
         Earn Should:
@@ -145,27 +376,12 @@ class StrategyCoreResolver:
         console.print("=== Compare Earn ===")
         self.manager.printCompare(before, after)
 
+        self.actionRules["earn"].verify(before, after, params)
+
         # Do nothing if there is not enough available want in sett to transfer.
-        # NB: Since we calculate available want by taking a percentage when
-        # balance is 1 it gets rounded down to 1.
         if before.balances("want", "sett") <= 1:
             return
 
-        assert after.balances("want", "sett") <= before.balances("want", "sett")
-
-        # All want should be in pool OR sitting in strategy, not a mix
-        assert (
-            after.get("strategy.balanceOfWant") == 0
-            and after.get("strategy.balanceOfPool")
-            > before.get("strategy.balanceOfPool")
-        ) or (
-            after.get("strategy.balanceOfWant") > before.get("strategy.balanceOfWant")
-            and after.get("strategy.balanceOfPool") == 0
-        )
-
-        assert after.get("strategy.balanceOf") > before.get("strategy.balanceOf")
-        assert after.balances("want", "user") == before.balances("want", "user")
-
         self.hook_after_earn(before, after, params)
 
     def confirm_withdraw(self, before, after, params, tx):
@@ -177,73 +393,14 @@ class StrategyCoreResolver:
         - Decrease the balance() tracked for want in the Strategy
         - Decrease the available() if it is not zero
         """
-        ppfs = before.get("sett.pricePerFullShare")
-
         console.print("=== Compare Withdraw ===")
         self.manager.printCompare(before, after)
 
+        self.actionRules["withdraw"].verify(before, after, params)
+
         if params["amount"] == 0:
-            assert after.get("sett.totalSupply") == before.get("sett.totalSupply")
-            # Decrease the Sett tokens for the user based on withdrawAmount and pricePerFullShare
-            assert after.balances("sett", "user") == before.balances("sett", "user")
             return
 
-        # Decrease the totalSupply of Sett tokens
-        assert after.get("sett.totalSupply") < before.get("sett.totalSupply")
-
-        # Decrease the Sett tokens for the user based on withdrawAmount and pricePerFullShare
-        assert after.balances("sett", "user") < before.balances("sett", "user")
-
-        # Decrease the want in the Sett, if there was idle want
-        if before.balances("want", "sett") > 0:
-            assert after.balances("want", "sett") < before.balances("want", "sett")
-
-            # Available in the sett should decrease if want decreased
-            assert after.get("sett.available") <= before.get("sett.available")
-
-        # Want in the strategy should be decreased, if idle in sett is insufficient to cover withdrawal
-        if params["amount"] > before.balances("want", "sett"):
-            # Adjust amount based on total balance x total supply
-            # Division in python is not accurate, use Decimal package to ensure division is consistent w/ division inside of EVM
-            expectedWithdraw = Decimal(
-                params["amount"] * before.get("sett.balance")
-            ) / Decimal(before.get("sett.totalSupply"))
-            # Withdraw from idle in sett first
-            expectedWithdraw -= before.balances("want", "sett")
-            # First we attempt to withdraw from idle want in strategy
-            if expectedWithdraw > before.balances("want", "strategy"):
-                # If insufficient, we then attempt to withdraw from activities (balance of pool)
-                # Just ensure that we have enough in the pool balance to satisfy the request
-                expectedWithdraw -= before.balances("want", "strategy")
-                assert expectedWithdraw <= before.get("strategy.balanceOfPool")
-
-                assert approx(
-                    before.get("strategy.balanceOfPool"),
-                    after.get("strategy.balanceOfPool") + expectedWithdraw,
-                    1,
-                )
-
-        # The total want between the strategy and sett should be less after than before
-        # if there was previous want in strategy or sett (sometimes we withdraw entire
-        # balance from the strategy pool) which we check above.
-        if (
-            before.balances("want", "strategy") > 0
-            or before.balances("want", "sett") > 0
-        ):
-            assert after.balances("want", "strategy") + after.balances(
-                "want", "sett"
-            ) < before.balances("want", "strategy") + before.balances("want", "sett")
-
-        # Controller rewards should earn
-        if (
-            before.get("strategy.withdrawalFee") > 0
-            and
-            # Fees are only processed when withdrawing from the strategy.
-            before.balances("want", "strategy") > after.balances("want", "strategy")
-        ):
-            assert after.balances("want", "governanceRewards") > before.balances(
-                "want", "governanceRewards"
-            )
         self.hook_after_confirm_withdraw(before, after, params)
 
     def confirm_deposit(self, before, after, params):
@@ -254,42 +411,10 @@ class StrategyCoreResolver:
         - Increase the balanceOf() want in the Sett by depositAmount
         - Decrease the balanceOf() want of the user by depositAmount
         """
-
-        ppfs = before.get("sett.pricePerFullShare")
         console.print("=== Compare Deposit ===")
         self.manager.printCompare(before, after)
 
-        expected_shares = Decimal(params["amount"] * Wei("1 ether")) / Decimal(ppfs)
-        if params.get("expected_shares") is not None:
-            expected_shares = params["expected_shares"]
-
-        # Increase the totalSupply() of Sett tokens
-        assert approx(
-            after.get("sett.totalSupply"),
-            before.get("sett.totalSupply") + expected_shares,
-            1,
-        )
-
-        # Increase the balanceOf() want in the Sett by depositAmount
-        assert approx(
-            after.balances("want", "sett"),
-            before.balances("want", "sett") + params["amount"],
-            1,
-        )
-
-        # Decrease the balanceOf() want of the user by depositAmount
-        assert approx(
-            after.balances("want", "user"),
-            before.balances("want", "user") - params["amount"],
-            1,
-        )
-
-        # Increase the balanceOf() Sett tokens for the user based on depositAmount / pricePerFullShare
-        assert approx(
-            after.balances("sett", "user"),
-            before.balances("sett", "user") + expected_shares,
-            1,
-        )
+        self.actionRules["deposit"].verify(before, after, params)
         self.hook_after_confirm_deposit(before, after, params)
 
     # ===== Strategies must implement =====
@@ -0,0 +1,140 @@
+"""
+Exact uint256 math matching Solidity SafeMath: mul and div round down, overflow and
+division by zero raise instead of reverting.
+
+Every function takes Python ints or NumPy object arrays of ints (one entry per amount),
+object arrays keep exact uint256 values where float64 would not.
+
+    supply = before.get("sett.totalSupply")
+    shares = deposit_shares(amount, before.get("sett.balance"), supply)
+    mismatches(after.get("sett.totalSupply") - supply, shares, 1)
+"""
+
+import numpy as np
+
+UNIT = 10 ** 18
+MAX_UINT256 = 2 ** 256 - 1
+
+
+def values(x):
+    return np.asarray(x, dtype=object) if isinstance(x, (list, tuple)) else x
+
+
+def mul(a, b):
+    product = values(a) * values(b)
+    if np.any(product > MAX_UINT256):
+        raise OverflowError("SafeMath: multiplication overflow")
+    return product
+
+
+def div(a, b):
+    b = values(b)
+    if np.any(b == 0):
+        raise ZeroDivisionError("SafeMath: division by zero")
+    return values(a) // b
+
+
+def mul_div(a, b, c):
+    """
+    a.mul(b).div(c)
+    """
+    return div(mul(a, b), c)
+
+
+def where_supply(totalSupply, empty, fn, *args):
+    """
+    `empty` where totalSupply is 0, fn(*args, totalSupply) elsewhere. Rows of an empty
+    sett never reach fn, so their divisors may be 0
+    """
+    totalSupply = values(totalSupply)
+    if not isinstance(totalSupply, np.ndarray):
+        return empty if totalSupply == 0 else fn(*args, totalSupply)
+    live = np.asarray(totalSupply != 0, dtype=bool)
+    result = np.array(np.broadcast_to(values(empty), live.shape), dtype=object)
+    if live.any():
+        args = [values(a) for a in args]
+        args = [a[live] if isinstance(a, np.ndarray) else a for a in args]
+        result[live] = fn(*args, totalSupply[live])
+    return result
+
+
+# ===== SettV3 =====
+
+
+def ppfs(balance, totalSupply):
+    """
+    getPricePerFullShare(): balance().mul(1e18).div(totalSupply()), 1e18 when empty
+    """
+    return where_supply(
+        totalSupply,
+        UNIT,
+        lambda balance, supply: mul_div(balance, UNIT, supply),
+        balance,
+    )
+
+
+def deposit_shares(amount, pool, totalSupply):
+    """
+    _deposit(): shares minted for `amount` received, pool is balance() before transfer
+    """
+    return where_supply(
+        totalSupply,
+        amount,
+        lambda amount, pool, supply: mul_div(amount, supply, pool),
+        amount,
+        pool,
+    )
+
+
+def withdraw_amount(shares, balance, totalSupply):
+    """
+    _withdraw(): want owed for burning `shares`, before the strategy shortfall top up
+    """
+    return mul_div(balance, shares, totalSupply)
+
+
+# ===== Tolerance =====
+
+
+class Mismatch:
+    __slots__ = ("index", "actual", "expected", "diff", "allowed")
+
+    def __init__(self, index, actual, expected, diff, allowed):
+        self.index = index
+        self.actual = actual
+        self.expected = expected
+        self.diff = diff
+        self.allowed = allowed
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return "Mismatch({})".format(self.as_dict())
+
+
+def mismatches(actual, expected, percentage_threshold=0, tolerance=0):
+    """
+    [] when actual matches expected, else a Mismatch per entry off by more than allowed.
+    Matches helpers.utils.approx: equal, within `tolerance` wei, or off by less than
+    percentage_threshold % of actual. Nothing is printed
+    """
+    actual = values(actual)
+    expected = values(expected)
+    diff = abs(actual - expected)
+    allowed = actual * percentage_threshold // 100
+    ok = (diff == 0) | (diff <= tolerance) | (diff < allowed)
+    if not isinstance(ok, np.ndarray):
+        return [] if ok else [Mismatch(None, actual, expected, diff, allowed)]
+
+    actual, expected, diff, allowed = np.broadcast_arrays(
+        actual, expected, diff, allowed
+    )
+    return [
+        Mismatch(int(i), actual[i], expected[i], diff[i], allowed[i])
+        for i in np.flatnonzero(~np.asarray(ok, dtype=bool))
+    ]
+
+
+def close(actual, expected, percentage_threshold=0, tolerance=0):
+    return not mismatches(actual, expected, percentage_threshold, tolerance)
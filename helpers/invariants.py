@@ -0,0 +1,298 @@
+"""
+Declarative checks over before / after snaps.
+
+Rules are expressions over snap fields and action params, built once and evaluated on a
+single transition (scalars) or on many at once (NumPy object arrays, exact ints):
+
+    userWant = Before.balances("want", "user")
+    RULES = RuleSet(
+        Rule("user pays", After.balances("want", "user") == userWant - Param("amount")),
+    )
+
+    RULES.verify(before, after, {"amount": amount})         # one transition, asserts
+    RULES.failures(Transitions.from_pairs(pairs, params))   # {rule: failing rows}
+
+Use &, | and ~ to combine conditions, `and` / `or` / `not` do not build expressions.
+"""
+
+import operator
+
+import numpy as np
+
+from helpers.snapshot.diff import SnapDiff
+
+
+def floordiv(a, b):
+    """
+    Floor division yielding 0 on a zero divisor, rows guarded out by `when` may hit one
+    """
+    if isinstance(a, np.ndarray) or isinstance(b, np.ndarray):
+        zero = np.asarray(b == 0, dtype=bool)
+        return np.where(zero, 0, a // np.where(zero, 1, b))
+    return 0 if b == 0 else a // b
+
+
+class Expr:
+    def evaluate(self, env):
+        raise NotImplementedError
+
+    def __add__(self, other):
+        return Op(operator.add, self, other)
+
+    def __radd__(self, other):
+        return Op(operator.add, other, self)
+
+    def __sub__(self, other):
+        return Op(operator.sub, self, other)
+
+    def __rsub__(self, other):
+        return Op(operator.sub, other, self)
+
+    def __mul__(self, other):
+        return Op(operator.mul, self, other)
+
+    def __rmul__(self, other):
+        return Op(operator.mul, other, self)
+
+    def __floordiv__(self, other):
+        return Op(floordiv, self, other)
+
+    def __rfloordiv__(self, other):
+        return Op(floordiv, other, self)
+
+    def __abs__(self):
+        return Op(abs, self)
+
+    def __lt__(self, other):
+        return Op(operator.lt, self, other)
+
+    def __le__(self, other):
+        return Op(operator.le, self, other)
+
+    def __gt__(self, other):
+        return Op(operator.gt, self, other)
+
+    def __ge__(self, other):
+        return Op(operator.ge, self, other)
+
+    def __eq__(self, other):
+        return Op(operator.eq, self, other)
+
+    def __ne__(self, other):
+        return Op(operator.ne, self, other)
+
+    def __and__(self, other):
+        return Op(np.logical_and, self, other)
+
+    def __or__(self, other):
+        return Op(np.logical_or, self, other)
+
+    def __invert__(self):
+        return Op(np.logical_not, self)
+
+    __hash__ = None
+
+
+def evaluate(value, env):
+    return value.evaluate(env) if isinstance(value, Expr) else value
+
+
+class Op(Expr):
+    def __init__(self, fn, *args):
+        self.fn = fn
+        self.args = args
+
+    def evaluate(self, env):
+        return self.fn(*[evaluate(arg, env) for arg in self.args])
+
+
+class Before(Expr):
+    side = "before"
+
+    def __init__(self, key):
+        self.key = key
+
+    @classmethod
+    def balances(cls, tokenKey, accountKey):
+        return cls("balances." + tokenKey + "." + accountKey)
+
+    @classmethod
+    def shares(cls, tokenKey, accountKey):
+        return cls("shares." + tokenKey + "." + accountKey)
+
+    def evaluate(self, env):
+        return env.field(self.side, self.key)
+
+
+class After(Before):
+    side = "after"
+
+
+class Param(Expr):
+    """
+    Action parameter, e.g. the deposited amount. `default` is used when it is not given
+    """
+
+    def __init__(self, name, default=None):
+        self.name = name
+        self.default = default
+
+    def evaluate(self, env):
+        if self.name in env.params and env.params[self.name] is not None:
+            return env.params[self.name]
+        if self.default is None:
+            raise KeyError("missing param {}".format(self.name))
+        return evaluate(self.default, env)
+
+
+def approx(actual, expected, percentage_threshold):
+    """
+    helpers.fixedpoint.close as an expression: equal, or off by less than threshold %
+    """
+    diff = abs(actual - expected)
+    return (diff == 0) | (diff < actual * percentage_threshold // 100)
+
+
+class Rule:
+    def __init__(self, name, check: Expr, when: Expr = None):
+        self.name = name
+        self.check = check
+        self.when = when
+
+    def evaluate(self, env):
+        """
+        True (per transition) where the rule holds or does not apply
+        """
+        passed = np.asarray(self.check.evaluate(env), dtype=bool)
+        if self.when is not None:
+            passed = passed | ~np.asarray(self.when.evaluate(env), dtype=bool)
+        return passed
+
+    def keys(self):
+        return referenced_keys(
+            self.check if self.when is None else self.check & self.when
+        )
+
+
+class RuleSet:
+    """
+    Rules checked together, `when` guards every rule of the set
+    """
+
+    def __init__(self, *rules, when: Expr = None):
+        self.rules = list(rules)
+        self.when = when
+
+    def __add__(self, other):
+        return RuleSet(*self.guarded(), *other.guarded())
+
+    def __len__(self):
+        return len(self.rules)
+
+    def guarded(self):
+        """
+        Rules with the set's own guard folded in
+        """
+        if self.when is None:
+            return list(self.rules)
+        return [
+            Rule(
+                rule.name,
+                rule.check,
+                self.when if rule.when is None else self.when & rule.when,
+            )
+            for rule in self.rules
+        ]
+
+    def evaluate(self, env):
+        """
+        {rule name: passed}, scalars for a SnapPair and bool arrays for Transitions
+        """
+        return {rule.name: rule.evaluate(env) for rule in self.guarded()}
+
+    def failures(self, env):
+        """
+        {rule name: indexes of failing transitions} for every rule that failed somewhere
+        """
+        failed = {}
+        for name, passed in self.evaluate(env).items():
+            rows = np.flatnonzero(~np.atleast_1d(passed))
+            if len(rows):
+                failed[name] = rows
+        return failed
+
+    def verify(self, before, after, params=None):
+        failed = self.failures(SnapPair(before, after, params))
+        assert not failed, "rules failed {} -> {}: {}".format(
+            before.block, after.block, ", ".join(failed)
+        )
+
+
+class SnapPair:
+    """
+    A single transition, fields evaluate to plain ints
+    """
+
+    def __init__(self, before, after, params=None):
+        self.snaps = {"before": before, "after": after}
+        self.params = params or {}
+
+    def field(self, side, key):
+        return self.snaps[side].get(key)
+
+
+class Transitions:
+    """
+    Many transitions as columns over a SnapDiff, fields evaluate to object arrays.
+    params values may be scalars or arrays with one entry per transition
+    """
+
+    def __init__(self, diff: SnapDiff, beforeRows, afterRows, params=None):
+        self.diff = diff
+        self.rows = {"before": beforeRows, "after": afterRows}
+        self.params = params or {}
+
+    @classmethod
+    def from_pairs(cls, pairs, params=None):
+        """
+        [(before, after), ...], e.g. the snaps around every recorded harvest
+        """
+        pairs = list(pairs)
+        diff = SnapDiff([snap for pair in pairs for snap in pair])
+        rows = np.arange(len(pairs)) * 2
+        return cls(diff, rows, rows + 1, params)
+
+    @classmethod
+    def from_history(cls, snaps, params=None):
+        """
+        Every consecutive pair of a snap history
+        """
+        diff = SnapDiff(snaps)
+        rows = np.arange(len(diff) - 1)
+        return cls(diff, rows, rows + 1, params)
+
+    def __len__(self):
+        return len(self.rows["before"])
+
+    def field(self, side, key):
+        column = self.diff.positions.get(key)
+        if column is None:
+            raise Exception("Key {} not found in snap data".format(key))
+        return self.diff.values[self.rows[side], column]
+
+
+def referenced_keys(expr):
+    """
+    Snap keys an expression reads, in first-seen order
+    """
+    keys = []
+    pending = [expr]
+    while pending:
+        item = pending.pop(0)
+        if isinstance(item, Before):
+            keys.append(item.key)
+        elif isinstance(item, Op):
+            pending.extend(item.args)
+        elif isinstance(item, Param) and isinstance(item.default, Expr):
+            pending.append(item.default)
+    return list(dict.fromkeys(keys))
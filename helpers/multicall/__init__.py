@@ -2,9 +2,15 @@
 Inlined version of bantegs' multicall.py for brownie compatibility
 https://github.com/banteg/multicall.py
 """
+
 __version__ = "0.1.1"
 
+from helpers.multicall.intern import intern_stats, clear_interned
 from helpers.multicall.signature import Signature
+from helpers.multicall.failure import CallFailure
 from helpers.multicall.call import Call
+from helpers.multicall.metrics import Metrics, get_metrics, set_metrics
+from helpers.multicall.cache import ResponseCache
+from helpers.multicall.plan import CallPlan
 from helpers.multicall.multicall import Multicall
 from helpers.multicall.functions import func, as_wei
@@ -0,0 +1,176 @@
+"""
+asyncio flavour of Call / Multicall for processes watching many vaults at once.
+Encoding and decoding go through the same Signature and CallPlan as the sync helpers,
+requests share one pooled keep-alive HTTP session instead of brownie's web3.
+"""
+
+import asyncio
+import json
+from itertools import count
+
+import aiohttp
+
+from helpers.multicall import Call, Multicall
+from helpers.multicall.cache import cacheable
+from helpers.multicall.constants import MULTICALL_ADDRESSES, MULTICALL2_ADDRESSES
+from helpers.multicall.metrics import get_metrics
+from helpers.multicall.plan import merge_retried, split_failures
+
+
+class RPCError(Exception):
+    pass
+
+
+def format_block(block_identifier):
+    if block_identifier is None:
+        return "latest"
+    if isinstance(block_identifier, int):
+        return hex(block_identifier)
+    return block_identifier
+
+
+class AsyncRPC:
+    """
+    JSON-RPC client on one pooled keep-alive HTTP session
+    At most `limit` requests are in flight, across every multicall sharing the client
+    eth_call pinned to a final block is served from `cache` when one is given
+    """
+
+    def __init__(self, url, limit=16, timeout=30, cache=None):
+        self.url = url
+        self.cache = cache
+        self.limit = limit
+        self.timeout = timeout
+        self.session = None
+        self.semaphore = None
+        self.ids = count(1)
+        self.requests = 0
+
+    async def open(self):
+        if self.session is None:
+            self.semaphore = asyncio.Semaphore(self.limit)
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.limit),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def request(self, method, params):
+        await self.open()
+        payload = {
+            "jsonrpc": "2.0",
+            "id": next(self.ids),
+            "method": method,
+            "params": params,
+        }
+        metrics = get_metrics()
+        async with self.semaphore:
+            self.requests += 1
+            with metrics.timer("rpc.latency_ms"):
+                async with self.session.post(self.url, json=payload) as response:
+                    body = await response.read()
+        metrics.count("rpc.calls")
+        metrics.observe("rpc.response_bytes", len(body))
+        body = json.loads(body)
+        if "error" in body:
+            raise RPCError(body["error"])
+        return body["result"]
+
+    async def chain_id(self):
+        return int(await self.request("eth_chainId", []), 16)
+
+    async def eth_call(self, to, data, block_identifier=None):
+        useCache = self.cache is not None and cacheable(block_identifier)
+        if useCache:
+            if self.cache.chainId is None:
+                self.cache.chainId = await self.chain_id()
+            if self.cache.head is None:
+                self.cache.head = int(await self.request("eth_blockNumber", []), 16)
+            useCache = self.cache.final(block_identifier)
+        if useCache:
+            output = self.cache.get(block_identifier, to, data)
+            if output is not None:
+                return output
+
+        get_metrics().observe("rpc.request_bytes", len(data))
+        result = await self.request(
+            "eth_call",
+            [{"to": to, "data": "0x" + data.hex()}, format_block(block_identifier)],
+        )
+        output = bytes.fromhex(result[2:])
+
+        if useCache:
+            self.cache.put(block_identifier, to, data, output)
+        return output
+
+
+class AsyncCall(Call):
+    async def __call__(self, rpc: AsyncRPC, args=None, block_identifier=None):
+        args = args or self.args
+        calldata = self.signature.encode_data(args)
+        output = await rpc.eth_call(self.target, calldata, block_identifier)
+        return self.decode_output(output)
+
+
+class AsyncMulticall(Multicall):
+    """
+    Same options as Multicall, chunks are sent concurrently on the shared AsyncRPC
+    The compiled plan is kept, later calls only send the stored payloads
+    """
+
+    plan = None
+
+    async def compile_async(self, rpc: AsyncRPC):
+        if self.plan is None:
+            if self.address is None:
+                addresses = (
+                    MULTICALL_ADDRESSES
+                    if self.require_success
+                    else MULTICALL2_ADDRESSES
+                )
+                self.address = addresses[await rpc.chain_id()]
+            self.plan = self.compile()
+        return self.plan
+
+    async def fetch(self, rpc: AsyncRPC, block_identifier=None):
+        plan = await self.compile_async(rpc)
+        results = await asyncio.gather(
+            *[
+                rpc.eth_call(plan.address, payload, block_identifier)
+                for payload in plan.payloads
+            ]
+        )
+        outputs = []
+        for result, chunk in zip(results, plan.chunks):
+            chunkOutputs = plan.unpack(result, len(chunk))
+            get_metrics().observe("multicall.calls_per_batch", len(chunkOutputs))
+            outputs.extend(chunkOutputs)
+        if plan.require_success:
+            return outputs
+
+        outputs, failed = split_failures(outputs)
+        for attempt in range(plan.retries):
+            if not failed:
+                break
+            retried = await rpc.eth_call(
+                plan.address, plan.retry_payload(failed), block_identifier
+            )
+            failed = merge_retried(outputs, failed, plan.unpack(retried, len(failed)))
+        return plan.mark_failures(outputs, failed)
+
+    async def __call__(self, rpc: AsyncRPC, block_identifier=None):
+        plan = await self.compile_async(rpc)
+        outputs = await self.fetch(rpc, block_identifier)
+        with get_metrics().timer("multicall.decode_ms"):
+            return plan.decode(outputs)
@@ -0,0 +1,134 @@
+"""
+Response cache for eth_call keyed by (chainId, block, target, calldata).
+
+State at a given block number never changes once final, so historical reads, report
+re-runs and backfills only need the node once per unique read. Only integer blocks at
+least `confirmations` below the head are cached: tip reads, "latest" and "pending"
+always go to the node, so a reorg or a brownie chain.revert() inside that depth is
+never served stale. Dev chains rewinding further than that still need clear().
+"""
+
+import sqlite3
+from collections import OrderedDict
+from threading import Lock
+
+from brownie import web3
+
+DEFAULT_CONFIRMATIONS = 64
+
+
+def cacheable(block_identifier):
+    return isinstance(block_identifier, int) and not isinstance(block_identifier, bool)
+
+
+class ResponseCache:
+    """
+    LRU bounded by `maxsize` entries and optionally `maxbytes` of return data,
+    backed by a SQLite file at `path` when given
+    """
+
+    def __init__(
+        self,
+        maxsize=4096,
+        maxbytes=None,
+        path=None,
+        chainId=None,
+        confirmations=DEFAULT_CONFIRMATIONS,
+    ):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.chainId = chainId
+        self.confirmations = confirmations
+        # Highest block known to exist, the node is only asked the first time
+        self.head = None
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "chain INTEGER, block INTEGER, target TEXT, calldata BLOB, output BLOB, "
+                "PRIMARY KEY (chain, block, target, calldata))"
+            )
+            self.db.commit()
+
+    def final(self, block):
+        """
+        Whether a read at `block` is deep enough below the head to be cached.
+        Reading a block proves the chain reached it, so later reads move the head
+        without asking the node
+        """
+        if self.head is None:
+            self.head = web3.eth.blockNumber
+        self.head = max(self.head, block)
+        return block <= self.head - self.confirmations
+
+    def key(self, block, target, calldata):
+        if self.chainId is None:
+            self.chainId = web3.eth.chainId
+        return (self.chainId, block, target.lower(), bytes(calldata))
+
+    def get(self, block, target, calldata):
+        key = self.key(block, target, calldata)
+        with self.lock:
+            output = self.entries.get(key)
+            if output is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return output
+            if self.db is not None:
+                row = self.db.execute(
+                    "SELECT output FROM responses "
+                    "WHERE chain = ? AND block = ? AND target = ? AND calldata = ?",
+                    key,
+                ).fetchone()
+                if row is not None:
+                    self.hits += 1
+                    self.remember(key, bytes(row[0]))
+                    return bytes(row[0])
+            self.misses += 1
+        return None
+
+    def put(self, block, target, calldata, output):
+        key = self.key(block, target, calldata)
+        output = bytes(output)
+        with self.lock:
+            self.remember(key, output)
+            if self.db is not None:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                    key + (output,),
+                )
+                self.db.commit()
+
+    def remember(self, key, output):
+        previous = self.entries.pop(key, None)
+        if previous is not None:
+            self.size -= len(previous)
+        self.entries[key] = output
+        self.size += len(output)
+        while len(self.entries) > self.maxsize or (
+            self.maxbytes and self.size > self.maxbytes and len(self.entries) > 1
+        ):
+            evicted, dropped = self.entries.popitem(last=False)
+            self.size -= len(dropped)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+            if self.db is not None:
+                self.db.execute("DELETE FROM responses")
+                self.db.commit()
+
+    def stats(self):
+        return {
+            "entries": len(self.entries),
+            "bytes": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -1,26 +1,66 @@
 # Credit: https://github.com/banteg/multicall.py/blob/master/multicall/call.py
-from eth_utils import to_checksum_address
 from brownie import web3
 from helpers.multicall import Signature
+from helpers.multicall.cache import cacheable
+from helpers.multicall.failure import CallFailure
+from helpers.multicall.intern import checksum
+from helpers.multicall.metrics import get_metrics
+
+
+def eth_call(target, calldata, block_identifier=None, cache=None):
+    """
+    eth_call through brownie's web3, served from `cache` when pinned to a final block
+    """
+    metrics = get_metrics()
+    useCache = (
+        cache is not None
+        and cacheable(block_identifier)
+        and cache.final(block_identifier)
+    )
+    if useCache:
+        output = cache.get(block_identifier, target, calldata)
+        if output is not None:
+            metrics.count("cache.hits")
+            return output
+
+    tx = {"to": target, "data": calldata}
+    with metrics.timer("rpc.latency_ms"):
+        if block_identifier is None:
+            output = web3.eth.call(tx)
+        else:
+            output = web3.eth.call(tx, block_identifier)
+    metrics.count("rpc.calls")
+    metrics.observe("rpc.request_bytes", len(calldata))
+    metrics.observe("rpc.response_bytes", len(output))
+
+    if useCache:
+        cache.put(block_identifier, target, calldata, output)
+    return output
 
 
 class Call:
-    def __init__(self, target, function, returns=None):
-        self.target = to_checksum_address(target)
+    def __init__(self, target, function, returns=None, cache=None):
+        self.target = checksum(target)
         if isinstance(function, list):
             self.function, *self.args = function
         else:
             self.function = function
             self.args = None
-        self.signature = Signature(self.function)
+        self.signature = Signature.intern(self.function)
         self.returns = returns
+        self.cache = cache
 
     @property
     def data(self):
         return self.signature.encode_data(self.args)
 
     def decode_output(self, output):
-        decoded = self.signature.decode_data(output)
+        return self.name_output(self.signature.decode_data(output))
+
+    def name_output(self, decoded):
+        """
+        Map already decoded values to the names and handlers in `returns`
+        """
         if self.returns:
             return {
                 name: handler(value) if handler else value
@@ -29,8 +69,16 @@ class Call:
         else:
             return decoded if len(decoded) > 1 else decoded[0]
 
-    def __call__(self, args=None):
+    def failed_output(self, failure: CallFailure):
+        """
+        Same shape as decode_output, with every value replaced by the failure
+        """
+        if self.returns:
+            return {name: failure for name, handler in self.returns}
+        return failure
+
+    def __call__(self, args=None, block_identifier=None):
         args = args or self.args
         calldata = self.signature.encode_data(args)
-        output = web3.eth.call({"to": self.target, "data": calldata})
+        output = eth_call(self.target, calldata, block_identifier, self.cache)
         return self.decode_output(output)
@@ -27,3 +27,11 @@ MULTICALL_ADDRESSES = {
     Network.Arbitrum: "0x7A7443F8c577d537f1d8cD4a629d40a3148Dd7ee",
     Network.Hardhat: "0x7A7443F8c577d537f1d8cD4a629d40a3148Dd7ee",
 }
+
+# Multicall2 adds tryAggregate / tryBlockAndAggregate, see network-config.yaml
+MULTICALL2_ADDRESSES = {
+    Network.Mainnet: "0x5BA1e12693Dc8F9c48aAD8770482f4739bEeD696",
+    Network.Forknet: "0x5BA1e12693Dc8F9c48aAD8770482f4739bEeD696",
+    Network.Arbitrum: "0x80C7DD17B01855a6D2347444a0FCC36136a314de",
+    Network.Hardhat: "0x80C7DD17B01855a6D2347444a0FCC36136a314de",
+}
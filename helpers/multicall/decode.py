@@ -0,0 +1,86 @@
+"""
+Fast paths for aggregate return data.
+
+Nearly every snapshot call returns a single uint256, so instead of running each output
+through eth_abi the bytes[] array is walked once over a memoryview and runs of uint256
+outputs are converted with int.from_bytes. Everything else keeps the generic decoder.
+"""
+
+from eth_abi.exceptions import DecodingError
+
+WORD = 32
+UINT256 = "(uint256)"
+
+
+def word(view, offset):
+    return int.from_bytes(view[offset : offset + WORD], "big")
+
+
+def within(view, end, what):
+    if end > len(view):
+        raise DecodingError(
+            "aggregate return data too short for {}: {} > {} bytes".format(
+                what, end, len(view)
+            )
+        )
+
+
+def unpack_aggregate(output, expected=None):
+    """
+    Split the (uint256,bytes[]) return of aggregate into the block and zero-copy
+    memoryviews over each call's output.
+    Raises DecodingError on truncated data or when the number of outputs is not
+    `expected`, e.g. an empty return from an address without the multicall contract
+    """
+    view = memoryview(output)
+    within(view, 2 * WORD, "the block and bytes[] offset")
+    block = word(view, 0)
+    start = word(view, WORD)
+    within(view, start + WORD, "the bytes[] length")
+    count = word(view, start)
+    if expected is not None and count != expected:
+        raise DecodingError(
+            "aggregate returned {} outputs for {} calls".format(count, expected)
+        )
+    base = start + WORD
+    within(view, base + count * WORD, "the bytes[] offsets")
+    outputs = []
+    for i in range(count):
+        offset = base + word(view, base + i * WORD)
+        within(view, offset + WORD, "output {} length".format(i))
+        length = word(view, offset)
+        within(view, offset + WORD + length, "output {}".format(i))
+        outputs.append(view[offset + WORD : offset + WORD + length])
+    return block, outputs
+
+
+def decode_uint256s(outputs):
+    """
+    One pass over a run of single uint256 outputs, raises ValueError on short data
+    """
+    values = [int.from_bytes(output[:WORD], "big") for output in outputs]
+    if any(len(output) < WORD for output in outputs):
+        raise ValueError("output shorter than a uint256 word")
+    return values
+
+
+def is_uint256_call(call):
+    return (
+        call.signature.output_types == UINT256
+        and call.returns is not None
+        and len(call.returns) == 1
+    )
+
+
+def uint256_runs(flags):
+    """
+    [start, end, fast] ranges of consecutive outputs sharing the same `fast` flag,
+    fast when the output is a single uint256 read under a single key
+    """
+    runs = []
+    for i, fast in enumerate(flags):
+        if runs and runs[-1][2] == fast:
+            runs[-1][1] = i + 1
+        else:
+            runs.append([i, i + 1, fast])
+    return runs
@@ -0,0 +1,56 @@
+from eth_abi.decoding import ContextFramesBytesIO
+from eth_abi.exceptions import DecodingError
+
+from helpers.multicall.intern import decoders, selectors
+
+ERROR_SELECTOR = selectors.get("Error(string)")
+PANIC_SELECTOR = selectors.get("Panic(uint256)")
+
+
+def decode_revert(data):
+    """
+    Human readable reason from revert data, Error(string) and Panic(uint256) are decoded
+    """
+    data = bytes(data)
+    if not data:
+        return "reverted without reason"
+    try:
+        if data[:4] == ERROR_SELECTOR:
+            (reason,) = decoders.get("(string)")(ContextFramesBytesIO(data[4:]))
+            return reason
+        if data[:4] == PANIC_SELECTOR:
+            (code,) = decoders.get("(uint256)")(ContextFramesBytesIO(data[4:]))
+            return "panic {}".format(hex(code))
+    except DecodingError:
+        pass
+    return "0x" + data.hex()
+
+
+class CallFailure:
+    """
+    Sentinel returned in place of a value when a call fails inside tryAggregate
+    Falsy, so `if value:` guards skip it
+    """
+
+    __slots__ = ("target", "function", "reason")
+
+    def __init__(self, target, function, reason):
+        self.target = target
+        self.function = function
+        self.reason = reason
+
+    def __bool__(self):
+        return False
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, CallFailure)
+            and self.target == other.target
+            and self.function == other.function
+        )
+
+    def __hash__(self):
+        return hash((self.target, self.function))
+
+    def __repr__(self):
+        return "CallFailure({} {}: {})".format(self.target, self.function, self.reason)
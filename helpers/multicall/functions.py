@@ -19,6 +19,7 @@ erc20 = DotMap(
     decimals="decimals()(uint256)",
 )
 sett = DotMap(
+    token="token()(address)",
     getPricePerFullShare="getPricePerFullShare()(uint256)",
     available="available()(uint256)",
     balance="balance()(uint256)",
@@ -29,12 +30,16 @@ sett = DotMap(
     shares="shares()(uint256)",
 )
 strategy = DotMap(
+    want="want()(address)",
+    governance="governance()(address)",
+    strategist="strategist()(address)",
     balanceOfPool="balanceOfPool()(uint256)",
     balanceOfWant="balanceOfWant()(uint256)",
     balanceOf="balanceOf()(uint256)",
     isTendable="isTendable()(bool)",
     getProtectedTokens="getProtectedTokens()(address[])",
     getName="getName()(string)",
+    version="version()(string)",
     withdrawalFee="withdrawalFee()(uint256)",
     performanceFeeGovernance="performanceFeeGovernance()(uint256)",
     performanceFeeStrategist="performanceFeeStrategist()(uint256)",
@@ -44,6 +49,7 @@ strategy = DotMap(
     sharesOfWant="sharesOfWant()(uint256)",
     sharesOf="sharesOf()(uint256)",
 )
+controller = DotMap(rewards="rewards()(address)")
 harvestFarm = DotMap(earned="earned()(uint256)")
 rewardPool = DotMap(
     # claimable rewards
@@ -65,6 +71,7 @@ func = DotMap(
     erc20=erc20,
     sett=sett,
     strategy=strategy,
+    controller=controller,
     rewardPool=rewardPool,
     diggFaucet=diggFaucet,
     digg=digg,
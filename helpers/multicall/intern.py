@@ -0,0 +1,71 @@
+"""
+Process-wide interning for the pieces every Call rebuilds:
+parsed signatures, 4-byte selectors, abi encoders / decoders and checksummed addresses.
+
+Each table is keyed by the plain string it was built from and counts hits and misses,
+so a long running monitor can confirm it is not re-parsing anything per snap.
+"""
+
+from eth_abi.registry import registry
+from eth_utils import function_signature_to_4byte_selector, to_checksum_address
+
+
+class InternTable:
+    """
+    String keyed cache that builds each value once with `factory`
+    Safe to share between threads: a race only builds the same value twice
+    """
+
+    def __init__(self, name, factory):
+        self.name = name
+        self.factory = factory
+        self.items = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        try:
+            value = self.items[key]
+        except KeyError:
+            self.misses += 1
+            value = self.items.setdefault(key, self.factory(key))
+        else:
+            self.hits += 1
+        return value
+
+    def clear(self):
+        self.items.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        return {"size": len(self.items), "hits": self.hits, "misses": self.misses}
+
+
+addresses = InternTable("addresses", to_checksum_address)
+selectors = InternTable("selectors", function_signature_to_4byte_selector)
+encoders = InternTable("encoders", registry.get_encoder)
+decoders = InternTable("decoders", registry.get_decoder)
+
+TABLES = [addresses, selectors, encoders, decoders]
+
+
+def register_table(table):
+    TABLES.append(table)
+    return table
+
+
+def checksum(address):
+    return addresses.get(address)
+
+
+def intern_stats():
+    """
+    Hit / miss counters for every table, keyed by table name
+    """
+    return {table.name: table.stats() for table in TABLES}
+
+
+def clear_interned():
+    for table in TABLES:
+        table.clear()
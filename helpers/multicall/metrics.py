@@ -0,0 +1,188 @@
+"""
+RPC instrumentation: round-trips, payload sizes, encode / decode time and snap latency,
+tagged by the caller that triggered them (e.g. settHarvest).
+
+Disabled by default, enable with `set_metrics(Metrics())` and read back with
+`get_metrics().summary()` or `.to_json()`.
+"""
+
+import json
+import math
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from threading import Lock
+
+from tabulate import tabulate
+
+UNTAGGED = "-"
+currentTag = ContextVar("metricsTag", default=UNTAGGED)
+
+
+class Histogram:
+    """
+    Power of two buckets, good enough for latencies and payload sizes
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+        self.buckets = defaultdict(int)
+
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        self.buckets[math.frexp(value)[1] if value > 0 else 0] += 1
+
+    def quantile(self, q):
+        """
+        Upper bound of the bucket holding the q-th observation
+        """
+        seen = 0
+        for exponent in sorted(self.buckets):
+            seen += self.buckets[exponent]
+            if seen >= q * self.count:
+                return min(2.0 ** exponent, self.max)
+        return self.max
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "mean": self.total / self.count if self.count else 0,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "buckets": {
+                "<={}".format(2 ** exponent): count
+                for exponent, count in sorted(self.buckets.items())
+            },
+        }
+
+
+class NullMetrics:
+    """
+    Default hook, records nothing
+    """
+
+    enabled = False
+
+    def observe(self, name, value):
+        pass
+
+    def count(self, name, value=1):
+        pass
+
+    @contextmanager
+    def timer(self, name):
+        yield
+
+    @contextmanager
+    def tag(self, name):
+        yield
+
+
+class Metrics(NullMetrics):
+    enabled = True
+
+    def __init__(self):
+        self.histograms = defaultdict(Histogram)
+        self.counters = defaultdict(int)
+        self.lock = Lock()
+
+    def observe(self, name, value):
+        with self.lock:
+            self.histograms[(currentTag.get(), name)].observe(value)
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[(currentTag.get(), name)] += value
+
+    @contextmanager
+    def timer(self, name):
+        """
+        Observe the elapsed time of the block, in milliseconds
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, (time.perf_counter() - start) * 1000)
+
+    @contextmanager
+    def tag(self, name):
+        token = currentTag.set(name)
+        try:
+            yield
+        finally:
+            currentTag.reset(token)
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+    def as_dict(self):
+        result = defaultdict(dict)
+        with self.lock:
+            for (tag, name), value in self.counters.items():
+                result[tag][name] = value
+            for (tag, name), histogram in self.histograms.items():
+                result[tag][name] = histogram.as_dict()
+        return dict(result)
+
+    def to_json(self, path=None):
+        data = json.dumps(self.as_dict(), indent=2, sort_keys=True)
+        if path:
+            with open(path, "w") as f:
+                f.write(data)
+        return data
+
+    def summary(self):
+        table = []
+        for tag, metrics in sorted(self.as_dict().items()):
+            for name, value in sorted(metrics.items()):
+                if isinstance(value, dict):
+                    table.append(
+                        [
+                            tag,
+                            name,
+                            value["count"],
+                            "{:.2f}".format(value["mean"]),
+                            "{:.2f}".format(value["p95"]),
+                            "{:.2f}".format(value["max"]),
+                        ]
+                    )
+                else:
+                    table.append([tag, name, value, "", "", ""])
+        return tabulate(table, headers=["tag", "metric", "count", "mean", "p95", "max"])
+
+
+metrics = NullMetrics()
+
+
+def get_metrics():
+    return metrics
+
+
+def set_metrics(hook):
+    """
+    Install the process-wide metrics hook, pass NullMetrics() to disable
+    """
+    global metrics
+    metrics = hook
+    return hook
+
+
+def in_context(fn):
+    """
+    Wrap fn so it runs with the caller's metrics tag when sent to a worker thread
+    """
+    context = copy_context()
+    return lambda *args: context.copy().run(fn, *args)
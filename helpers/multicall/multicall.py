@@ -1,18 +1,47 @@
 # Credit: https://github.com/banteg/multicall.py/blob/master/multicall/multicall.py
 from typing import List
 
-from brownie import web3
-
 from helpers.multicall import Call
-from helpers.multicall.constants import MULTICALL_ADDRESSES
+from helpers.multicall.plan import DEFAULT_WORKERS, CallPlan
 from rich.console import Console
 
 console = Console()
 
 
 class Multicall:
-    def __init__(self, calls: List[Call]):
+    def __init__(
+        self,
+        calls: List[Call],
+        max_calls=None,
+        max_bytes=None,
+        max_gas=None,
+        workers=DEFAULT_WORKERS,
+        require_success=True,
+        with_block=False,
+        retries=0,
+        address=None,
+        cache=None,
+    ):
+        """
+        max_calls, max_bytes and max_gas bound each aggregate eth_call,
+        calls over budget are split into chunks sent on `workers` threads
+
+        require_success=False switches to Multicall2 tryAggregate,
+        failed calls come back as CallFailure and are retried `retries` times
+
+        address overrides the multicall contract looked up from the connected chain,
+        cache is a ResponseCache for reads pinned to a final block number
+        """
         self.calls = calls
+        self.max_calls = max_calls
+        self.max_bytes = max_bytes
+        self.max_gas = max_gas
+        self.workers = workers
+        self.require_success = require_success
+        self.with_block = with_block
+        self.retries = retries
+        self.address = address
+        self.cache = cache
 
     def printCalls(self):
         for call in self.calls:
@@ -20,14 +49,22 @@ class Multicall:
                 {"target": call.target, "function": call.function, "args": call.args}
             )
 
-    def __call__(self):
-        aggregate = Call(
-            MULTICALL_ADDRESSES[web3.eth.chainId],
-            "aggregate((address,bytes)[])(uint256,bytes[])",
+    def compile(self):
+        """
+        Encode the calls once, the returned CallPlan can be re-sent on every snap
+        """
+        return CallPlan(
+            self.calls,
+            address=self.address,
+            max_calls=self.max_calls,
+            max_bytes=self.max_bytes,
+            max_gas=self.max_gas,
+            workers=self.workers,
+            require_success=self.require_success,
+            with_block=self.with_block,
+            retries=self.retries,
+            cache=self.cache,
         )
-        args = [[[call.target, call.data] for call in self.calls]]
-        block, outputs = aggregate(args)
-        result = {}
-        for call, output in zip(self.calls, outputs):
-            result.update(call.decode_output(output))
-        return result
+
+    def __call__(self, block_identifier=None):
+        return self.compile()(block_identifier)
@@ -0,0 +1,400 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from brownie import web3
+from eth_abi.exceptions import DecodingError
+
+from helpers.multicall import Call, Signature
+from helpers.multicall.call import eth_call
+from helpers.multicall.constants import MULTICALL_ADDRESSES, MULTICALL2_ADDRESSES
+from helpers.multicall.decode import (
+    decode_uint256s,
+    is_uint256_call,
+    uint256_runs,
+    unpack_aggregate,
+)
+from helpers.multicall.failure import CallFailure, decode_revert
+from helpers.multicall.metrics import get_metrics, in_context
+
+AGGREGATE = "aggregate((address,bytes)[])(uint256,bytes[])"
+TRY_AGGREGATE = "tryAggregate(bool,(address,bytes)[])((bool,bytes)[])"
+TRY_BLOCK_AND_AGGREGATE = (
+    "tryBlockAndAggregate(bool,(address,bytes)[])(uint256,bytes32,(bool,bytes)[])"
+)
+
+# Rough cost of a single view call inside aggregate, on top of its calldata
+CALL_GAS_ESTIMATE = 50000
+CALLDATA_BYTE_GAS = 16
+DEFAULT_WORKERS = 8
+
+
+def encoded_size(call):
+    """
+    Bytes a call adds to the aggregate payload: address, offset, length and padded data
+    """
+    return 128 + -(-len(call.data) // 32) * 32
+
+
+def estimated_gas(call, gas_per_call=CALL_GAS_ESTIMATE):
+    return gas_per_call + CALLDATA_BYTE_GAS * len(call.data)
+
+
+def split_calls(
+    calls, max_calls=None, max_bytes=None, max_gas=None, gas_per_call=CALL_GAS_ESTIMATE
+):
+    """
+    Split calls into consecutive chunks that stay within every configured budget
+    A single call over budget still gets its own chunk
+    """
+    chunks = []
+    chunk = []
+    size = gas = 0
+    for call in calls:
+        callSize = encoded_size(call)
+        callGas = estimated_gas(call, gas_per_call)
+        if chunk and (
+            (max_calls and len(chunk) + 1 > max_calls)
+            or (max_bytes and size + callSize > max_bytes)
+            or (max_gas and gas + callGas > max_gas)
+        ):
+            chunks.append(chunk)
+            chunk = []
+            size = gas = 0
+        chunk.append(call)
+        size += callSize
+        gas += callGas
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def split_failures(results):
+    """
+    (success, data) pairs from tryAggregate into outputs and the indexes that failed
+    """
+    outputs = [data for success, data in results]
+    failed = [i for i, (success, data) in enumerate(results) if not success]
+    return outputs, failed
+
+
+def merge_retried(outputs, failed, retried):
+    """
+    Write retried results back in place, returns the indexes that failed again
+    """
+    stillFailed = []
+    for i, (success, data) in zip(failed, retried):
+        outputs[i] = data
+        if not success:
+            stillFailed.append(i)
+    return stillFailed
+
+
+class CallPlan:
+    """
+    A Multicall compiled once and replayed many times.
+    The aggregate calldata is encoded up front, outputs are decoded through a fixed table
+
+    Duplicate (target, calldata) reads are sent once, `saved` counts the calls avoided.
+    Calls are split into chunks bounded by max_calls / max_bytes / max_gas,
+    chunks are sent concurrently and their outputs merged back in call order
+
+    With require_success=False the plan uses Multicall2 tryAggregate (or tryBlockAndAggregate
+    when with_block is set): a reverting call comes back as a CallFailure and only the failed
+    calls are re-sent, up to `retries` times
+
+    A ResponseCache passed as `cache` serves reads pinned to a block number
+    """
+
+    def __init__(
+        self,
+        calls: List[Call],
+        address=None,
+        max_calls=None,
+        max_bytes=None,
+        max_gas=None,
+        workers=DEFAULT_WORKERS,
+        require_success=True,
+        with_block=False,
+        retries=0,
+        cache=None,
+    ):
+        start = time.perf_counter()
+        self.calls = list(calls)
+        self.cache = cache
+        self.workers = workers
+        self.require_success = require_success
+        self.retries = retries
+        self.block = None
+        # Only tryBlockAndAggregate returns the hash of the block read
+        self.blockHash = None
+        if require_success:
+            self.address = address or MULTICALL_ADDRESSES[web3.eth.chainId]
+            self.aggregate = Signature.intern(AGGREGATE)
+        else:
+            self.address = address or MULTICALL2_ADDRESSES[web3.eth.chainId]
+            self.aggregate = Signature.intern(
+                TRY_BLOCK_AND_AGGREGATE if with_block else TRY_AGGREGATE
+            )
+        # Identical reads are sent once, the output is fanned out to every call asking for it
+        self.unique = []
+        self.requests = []
+        seen = {}
+        for call in self.calls:
+            key = (call.target, call.data, call.signature.output_types)
+            if key not in seen:
+                seen[key] = len(self.unique)
+                self.unique.append(call)
+                self.requests.append([])
+            self.requests[seen[key]].append(call)
+        self.saved = len(self.calls) - len(self.unique)
+
+        self.chunks = split_calls(self.unique, max_calls, max_bytes, max_gas)
+        self.payloads = [self.encode(chunk) for chunk in self.chunks]
+        # Ordered decode table, one entry per unique call
+        fast = [
+            all(is_uint256_call(call) for call in requests)
+            for requests in self.requests
+        ]
+        self.runs = uint256_runs(fast)
+        # Values come out as a flat list in `keys` order
+        self.keys = list(
+            dict.fromkeys(name for call in self.calls for name, _ in call.returns or [])
+        )
+        self.positions = {key: i for i, key in enumerate(self.keys)}
+        # Unique call producing each key, for decoding a single field on demand
+        self.sources = [None] * len(self.keys)
+        for i, requests in enumerate(self.requests):
+            for call in requests:
+                for name, handler in call.returns or []:
+                    self.sources[self.positions[name]] = i
+        self.returns = [
+            (
+                [
+                    (self.positions[call.returns[0][0]], call.returns[0][1])
+                    for call in requests
+                ]
+                if isFast
+                else None
+            )
+            for requests, isFast in zip(self.requests, fast)
+        ]
+        get_metrics().observe(
+            "multicall.encode_ms", (time.perf_counter() - start) * 1000
+        )
+
+    def __len__(self):
+        return len(self.unique)
+
+    def encode(self, calls):
+        pairs = [[call.target, call.data] for call in calls]
+        if self.require_success:
+            return self.aggregate.encode_data([pairs])
+        return self.aggregate.encode_data([False, pairs])
+
+    def unpack(self, output, expected):
+        """
+        Per-call outputs from the raw aggregate return data of `expected` calls
+        """
+        if self.require_success:
+            self.block, outputs = unpack_aggregate(output, expected)
+            return outputs
+        decoded = self.aggregate.decode_data(output)
+        # tryBlockAndAggregate leads with the block number and hash
+        if len(decoded) > 1:
+            self.block, self.blockHash = decoded[0], decoded[1]
+        if len(decoded[-1]) != expected:
+            raise DecodingError(
+                "aggregate returned {} results for {} calls".format(
+                    len(decoded[-1]), expected
+                )
+            )
+        return decoded[-1]
+
+    def fetch_chunk(self, payload, expected, block_identifier=None):
+        output = eth_call(self.address, payload, block_identifier, self.cache)
+        outputs = self.unpack(output, expected)
+        get_metrics().observe("multicall.calls_per_batch", len(outputs))
+        return outputs
+
+    def fetch(self, block_identifier=None):
+        """
+        Send the stored payloads, returns the raw output of every call in order
+        In tryAggregate mode failed calls are returned as CallFailure
+        All chunks read the same block when block_identifier is given
+        """
+        if not self.payloads:
+            return []
+        if len(self.payloads) == 1:
+            outputs = list(
+                self.fetch_chunk(
+                    self.payloads[0], len(self.chunks[0]), block_identifier
+                )
+            )
+        else:
+            outputs = []
+            with ThreadPoolExecutor(
+                max_workers=min(self.workers, len(self.payloads))
+            ) as pool:
+                fetch = in_context(self.fetch_chunk)
+                for chunkOutputs in pool.map(
+                    lambda payload, chunk: fetch(payload, len(chunk), block_identifier),
+                    self.payloads,
+                    self.chunks,
+                ):
+                    outputs.extend(chunkOutputs)
+        if len(outputs) != len(self.unique):
+            raise DecodingError(
+                "multicall returned {} outputs for {} calls".format(
+                    len(outputs), len(self.unique)
+                )
+            )
+
+        if self.require_success:
+            return outputs
+        return self.retry_failures(outputs, block_identifier)
+
+    def retry_failures(self, results, block_identifier=None):
+        outputs, failed = split_failures(results)
+        for attempt in range(self.retries):
+            if not failed:
+                break
+            retried = self.fetch_chunk(
+                self.retry_payload(failed), len(failed), block_identifier
+            )
+            failed = merge_retried(outputs, failed, retried)
+        return self.mark_failures(outputs, failed)
+
+    def retry_payload(self, failed):
+        return self.encode([self.unique[i] for i in failed])
+
+    def mark_failures(self, outputs, failed):
+        for i in failed:
+            call = self.unique[i]
+            outputs[i] = CallFailure(
+                call.target, call.function, decode_revert(outputs[i])
+            )
+        return outputs
+
+    def decode(self, outputs):
+        return dict(zip(self.keys, self.decode_values(outputs)))
+
+    def decode_values(self, outputs):
+        """
+        Decoded values as a list aligned with `keys`
+        """
+        values = [None] * len(self.keys)
+        for start, end, fast in self.runs:
+            if fast:
+                try:
+                    words = decode_uint256s(outputs[start:end])
+                except (TypeError, ValueError):
+                    # A failure or short output in the run, decode it call by call
+                    pass
+                else:
+                    for returns, value in zip(self.returns[start:end], words):
+                        for position, handler in returns:
+                            values[position] = handler(value) if handler else value
+                    continue
+            for i in range(start, end):
+                for name, value in self.decode_call(i, outputs[i]):
+                    values[self.positions[name]] = value
+        return values
+
+    def decode_call(self, i, output):
+        """
+        (name, value) pairs for every call that asked for unique call i
+        """
+        call = self.unique[i]
+        if not isinstance(output, CallFailure):
+            try:
+                decoded = call.signature.decode_data(output)
+            except DecodingError:
+                if self.require_success:
+                    raise
+                # Succeeded without return data, e.g. the target has no code
+                output = CallFailure(
+                    call.target, call.function, "undecodable return data"
+                )
+            else:
+                return [
+                    item
+                    for request in self.requests[i]
+                    for item in request.name_output(decoded).items()
+                ]
+
+        return [
+            item
+            for request in self.requests[i]
+            for item in request.failed_output(output).items()
+        ]
+
+    def values(self, block_identifier=None):
+        """
+        Fetch and decode, returns values aligned with `keys`
+        """
+        outputs = self.fetch(block_identifier)
+        with get_metrics().timer("multicall.decode_ms"):
+            return self.decode_values(outputs)
+
+    def lazy_values(self, block_identifier=None):
+        """
+        Fetch only, values are decoded from the raw outputs the first time they are read
+        """
+        return LazyValues(self, self.fetch(block_identifier))
+
+    def __call__(self, block_identifier=None):
+        outputs = self.fetch(block_identifier)
+        with get_metrics().timer("multicall.decode_ms"):
+            return self.decode(outputs)
+
+
+PENDING = object()
+
+
+class LazyValues:
+    """
+    List-like view over raw call outputs aligned with a plan's `keys`.
+    A value is decoded on first read and cached, the raw outputs (memoryviews over the
+    aggregate response) are released once every value has been decoded
+    """
+
+    __slots__ = ("plan", "outputs", "items", "pending")
+
+    def __init__(self, plan: CallPlan, outputs):
+        self.plan = plan
+        self.outputs = outputs
+        self.items = [PENDING] * len(plan.keys)
+        self.pending = len(self.items)
+
+    def __getitem__(self, position):
+        value = self.items[position]
+        if value is PENDING:
+            i = self.plan.sources[position]
+            for name, decoded in self.plan.decode_call(i, self.outputs[i]):
+                self[self.plan.positions[name]] = decoded
+            value = self.items[position]
+        return value
+
+    def __setitem__(self, position, value):
+        if self.items[position] is PENDING:
+            self.pending -= 1
+            if self.pending == 0:
+                self.outputs = None
+        self.items[position] = value
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        for position in range(len(self.items)):
+            yield self[position]
+
+    def append(self, value):
+        self.items.append(value)
+
+    def decoded(self):
+        """
+        Number of values decoded so far
+        """
+        return len(self.plan.keys) - self.pending
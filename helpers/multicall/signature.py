@@ -1,7 +1,14 @@
 # Credit: https://github.com/banteg/multicall.py/blob/master/multicall/signature.py
 
-from eth_abi import encode_single, decode_single
-from eth_utils import function_signature_to_4byte_selector
+from eth_abi.decoding import ContextFramesBytesIO
+
+from helpers.multicall.intern import (
+    InternTable,
+    decoders,
+    encoders,
+    register_table,
+    selectors,
+)
 
 
 def parse_signature(signature):
@@ -32,14 +39,22 @@ class Signature:
         self.input_types = self.parts[1]
         self.output_types = self.parts[2]
         self.function = "".join(self.parts[:2])
-        self.fourbyte = function_signature_to_4byte_selector(self.function)
+        self.fourbyte = selectors.get(self.function)
+        self.encoder = encoders.get(self.input_types)
+        self.decoder = decoders.get(self.output_types)
+
+    @classmethod
+    def intern(cls, signature):
+        """
+        Shared instance for `signature`, parsed and compiled only once per process
+        """
+        return signatures.get(signature)
 
     def encode_data(self, args=None):
-        return (
-            self.fourbyte + encode_single(self.input_types, args)
-            if args
-            else self.fourbyte
-        )
+        return self.fourbyte + self.encoder(args) if args else self.fourbyte
 
     def decode_data(self, output):
-        return decode_single(self.output_types, output)
+        return self.decoder(ContextFramesBytesIO(output))
+
+
+signatures = register_table(InternTable("signatures", Signature))
@@ -0,0 +1,55 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from helpers.multicall import CallPlan
+from helpers.snapshot.snap import KeyIndex, Snap
+from helpers.snapshot.store import SnapStore
+
+logger = logging.getLogger(__name__)
+
+
+class Backfill:
+    """
+    Historical snaps of a call plan at every `step` blocks of a range.
+    Blocks are spread across a thread pool, snaps are written to the store in block order
+    """
+
+    def __init__(self, plan: CallPlan, store: SnapStore, entityKeys=None, workers=8):
+        self.plan = plan
+        self.keyIndex = KeyIndex.intern(plan.keys)
+        self.store = store
+        self.entityKeys = entityKeys or []
+        self.workers = workers
+
+    @classmethod
+    def from_manager(cls, manager, store, workers=8):
+        """
+        Backfill the entities and resolver calls a SnapshotManager currently tracks
+        """
+        entities = manager.entities
+        return cls(manager.get_plan(entities), store, list(entities.keys()), workers)
+
+    def snap(self, block):
+        return Snap.from_values(
+            self.keyIndex,
+            self.plan.values(block_identifier=block),
+            block,
+            self.entityKeys,
+        )
+
+    def run(self, start, end, step=1, skip_existing=True):
+        """
+        Snap every `step` blocks from start to end (inclusive), returns the number of new snaps
+        """
+        blocks = [
+            block
+            for block in range(start, end + 1, step)
+            if not (skip_existing and block in self.store)
+        ]
+        logger.info(f"backfill: {len(blocks)} blocks from {start} to {end}")
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for snap in pool.map(self.snap, blocks):
+                self.store.put(snap)
+
+        return len(blocks)
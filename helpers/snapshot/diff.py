@@ -0,0 +1,166 @@
+"""
+Diff any number of snaps at once.
+
+Snaps are laid out as a (snaps, keys) object array over the union of their keys, so
+changes, deltas and movers come out of whole-array operations instead of a per-key loop:
+
+    diff = SnapDiff(manager.snaps.values())
+    diff.changed          # (n - 1, keys) bool, step i compares snap i and i + 1
+    diff.delta            # exact int deltas, None where a side is not an int
+    diff.top_movers(10)   # biggest moves between the first and last snap
+
+Rendering lives in `render` and only runs when asked for.
+"""
+
+import numpy as np
+from tabulate import tabulate
+
+
+# type() of every cell in one ufunc pass, bools and CallFailures do not compare as int
+cell_type = np.frompyfunc(type, 1, 1)
+
+
+def object_rows(rows, width):
+    """
+    (len(rows), width) object array, tuple values (multi-return calls) stay single cells
+    """
+    if not rows:
+        return np.empty((0, width), dtype=object)
+    try:
+        values = np.array(rows, dtype=object)
+        if values.shape == (len(rows), width):
+            return values
+    except ValueError:
+        pass
+    # NumPy unpacked a tuple value into a dimension, place rows cell by cell instead
+    values = np.empty((len(rows), width), dtype=object)
+    for i, row in enumerate(rows):
+        for j, value in enumerate(row):
+            values[i, j] = value
+    return values
+
+
+class SnapDiff:
+    def __init__(self, snaps):
+        snaps = list(snaps)
+        self.blocks = np.array([snap.block for snap in snaps], dtype=np.int64)
+
+        # Row numbers of the snaps sharing each KeyIndex, in first seen order
+        groups = {}
+        indexes = {}
+        for row, snap in enumerate(snaps):
+            groups.setdefault(id(snap.index), []).append(row)
+            indexes.setdefault(id(snap.index), snap.index)
+        if len(indexes) == 1:
+            self.keys = list(snaps[0].index.keys)
+        else:
+            self.keys = list(
+                dict.fromkeys(key for i in indexes.values() for key in i.keys)
+            )
+        self.positions = {key: i for i, key in enumerate(self.keys)}
+
+        # One block assignment per KeyIndex instead of one per value
+        self.values = np.full((len(snaps), len(self.keys)), None, dtype=object)
+        for indexId, rows in groups.items():
+            index = indexes[indexId]
+            block = object_rows([list(snaps[row].values) for row in rows], len(index))
+            if len(indexes) == 1:
+                self.values[:] = block
+            else:
+                columns = [self.positions[key] for key in index.keys]
+                self.values[np.ix_(rows, columns)] = block
+
+        self.numeric = np.asarray(cell_type(self.values) == int, dtype=bool)
+        self.ints = np.where(self.numeric, self.values, 0)
+
+    def __len__(self):
+        return len(self.blocks)
+
+    @property
+    def changed(self):
+        """
+        (n - 1, keys) mask of values that differ between consecutive snaps
+        """
+        return np.asarray(self.values[1:] != self.values[:-1], dtype=bool)
+
+    @property
+    def comparable(self):
+        """
+        (n - 1, keys) mask of steps where both sides are ints
+        """
+        return self.numeric[1:] & self.numeric[:-1]
+
+    @property
+    def delta(self):
+        """
+        (n - 1, keys) exact int deltas, None where a side is not an int
+        """
+        return np.where(self.comparable, self.ints[1:] - self.ints[:-1], None)
+
+    @property
+    def relative(self):
+        """
+        (n - 1, keys) float deltas relative to the earlier value, nan when undefined
+        """
+        before = self.ints[:-1].astype(np.float64)
+        after = self.ints[1:].astype(np.float64)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            relative = (after - before) / np.abs(before)
+        relative[~self.comparable | (before == 0)] = np.nan
+        return relative
+
+    def changed_keys(self, step=None):
+        """
+        Keys changed at `step`, or anywhere in the history when step is None
+        """
+        changed = self.changed if step is None else self.changed[step : step + 1]
+        return [self.keys[i] for i in np.flatnonzero(changed.any(axis=0))]
+
+    def top_movers(self, k=10, relative=False, start=0, end=-1):
+        """
+        (keys, deltas) of the k largest moves between snap `start` and snap `end`
+        """
+        comparable = self.numeric[start] & self.numeric[end]
+        before = np.where(comparable, self.ints[start], 0)
+        after = np.where(comparable, self.ints[end], 0)
+        deltas = after - before
+        if relative:
+            base = np.abs(before.astype(np.float64))
+            with np.errstate(divide="ignore", invalid="ignore"):
+                deltas = deltas.astype(np.float64) / base
+            deltas[base == 0] = np.nan
+        magnitude = np.abs(deltas.astype(np.float64))
+        magnitude[~comparable | np.isnan(magnitude) | (magnitude == 0)] = -1
+        order = np.argsort(-magnitude, kind="stable")[:k]
+        order = order[magnitude[order] >= 0]
+        return np.array(self.keys, dtype=object)[order], deltas[order]
+
+    def rows(self, step=0):
+        """
+        [key, before, after, delta] for every key changed at `step`
+        """
+        delta = self.delta[step]
+        return [
+            [self.keys[i], self.values[step, i], self.values[step + 1, i], delta[i]]
+            for i in np.flatnonzero(self.changed[step])
+        ]
+
+
+def render(diff: SnapDiff, step=0, format=None, tablefmt="grid"):
+    """
+    Tabulate the changes at `step`, `format(key, value)` is applied to changed rows only
+    """
+    table = []
+    for key, before, after, delta in diff.rows(step):
+        if delta is None:
+            delta = "-"
+        if format is not None:
+            before, after, delta = (
+                format(key, before),
+                format(key, after),
+                format(key, delta),
+            )
+        table.append([key, before, after, delta])
+    return tabulate(
+        table, headers=["metric", "before", "after", "diff"], tablefmt=tablefmt
+    )
@@ -0,0 +1,121 @@
+"""
+Event-sourced snaps.
+
+Tracked ERC20 balances and supplies are moved by the Transfer logs of a receipt instead of
+being read again: the next snap is the previous one with every Transfer applied, and only
+the calls that logs cannot explain (price per share, pool balances, fees) are multicalled.
+A full snap every `verifyEvery` transactions catches drift, e.g. rebasing or fee-on-transfer
+tokens and transfers emitted by untracked contracts.
+"""
+
+from collections import defaultdict
+
+from helpers.multicall import Multicall
+from helpers.multicall.functions import as_original, as_wei, erc20
+from helpers.snapshot.snap import Snap
+
+TRANSFER = bytes.fromhex(
+    "ddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef"
+)
+ZERO_ADDRESS = "0x" + "00" * 20
+
+# Handlers that leave the value untouched, so logged amounts can be added to it
+IDENTITY = (None, as_wei, as_original)
+
+
+def as_bytes(value):
+    if isinstance(value, str):
+        return bytes.fromhex(value[2:] if value.startswith("0x") else value)
+    return bytes(value)
+
+
+def transfers(logs):
+    """
+    (token, sender, receiver, amount) for every ERC20 Transfer, addresses lowercased.
+    ERC721 transfers carry the id as a fourth topic and are skipped
+    """
+    for log in logs:
+        topics = [as_bytes(topic) for topic in log["topics"]]
+        if len(topics) != 3 or topics[0] != TRANSFER:
+            continue
+        yield (
+            log["address"].lower(),
+            "0x" + topics[1][12:].hex(),
+            "0x" + topics[2][12:].hex(),
+            int.from_bytes(as_bytes(log["data"])[:32], "big"),
+        )
+
+
+def single_key(call):
+    if call.returns is None or len(call.returns) != 1:
+        return None
+    name, handler = call.returns[0]
+    return name if handler in IDENTITY else None
+
+
+class EventSourcedSnaps:
+    """
+    Builds the snap after a transaction from the snap before it and the receipt logs
+    """
+
+    def __init__(self, calls, verifyEvery=10, **multicallOptions):
+        # (token, holder) -> keys, token -> keys
+        self.balances = defaultdict(list)
+        self.supplies = defaultdict(list)
+        rest = []
+        for call in calls:
+            key = single_key(call)
+            if key is not None and call.function == erc20.balanceOf:
+                self.balances[(call.target.lower(), call.args[0].lower())].append(key)
+            elif key is not None and call.function == erc20.totalSupply:
+                self.supplies[call.target.lower()].append(key)
+            else:
+                rest.append(call)
+        self.rest = Multicall(rest, **multicallOptions).compile() if rest else None
+        self.verifyEvery = verifyEvery
+        self.applied = 0
+
+    def next_snap(self, before: Snap, logs, block):
+        values = list(before.values)
+        positions = before.index.positions
+
+        def move(keys, amount):
+            for key in keys:
+                position = positions[key]
+                # A failed read stays failed until the next full snap
+                if type(values[position]) is int:
+                    values[position] += amount
+
+        for token, sender, receiver, amount in transfers(logs):
+            move(self.balances.get((token, sender), ()), -amount)
+            move(self.balances.get((token, receiver), ()), amount)
+            if sender == ZERO_ADDRESS:
+                move(self.supplies.get(token, ()), amount)
+            if receiver == ZERO_ADDRESS:
+                move(self.supplies.get(token, ()), -amount)
+
+        if self.rest is not None:
+            for key, value in zip(
+                self.rest.keys, self.rest.values(block_identifier=block)
+            ):
+                values[positions[key]] = value
+
+        self.applied += 1
+        return Snap.from_values(before.index, values, block, before.entityKeys)
+
+    def due(self):
+        """
+        True when the snap just built should be checked against a full multicall
+        """
+        return bool(self.verifyEvery) and self.applied % self.verifyEvery == 0
+
+    @staticmethod
+    def drift(derived: Snap, actual: Snap):
+        """
+        Keys whose event-sourced value differs from the one read on chain
+        """
+        return [
+            key
+            for key, a, b in zip(derived.index.keys, derived.values, actual.values)
+            if a != b
+        ]
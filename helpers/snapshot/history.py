@@ -0,0 +1,216 @@
+import json
+
+from helpers.snapshot.snap import KeyIndex, Snap
+from helpers.snapshot.store import SnapStore, encode_value
+
+KEYFRAME = 0
+DELTA = 1
+
+
+class SnapHistory(SnapStore):
+    """
+    Snap history stored as a full keyframe every `keyframeInterval` snaps and, in between,
+    sparse deltas (changed positions and values) against the previous snap.
+    Reading a block rebuilds the full Snap, so callers keep the usual Snap API.
+
+    A lazy snap following one from the same plan is diffed on its raw call outputs, only
+    the calls whose output bytes changed are decoded. Keyframes decode every value.
+
+    Also behaves like the {block: Snap} dict SnapshotManager.snaps used to be
+    """
+
+    def __init__(self, keyframeInterval=32):
+        self.keyframeInterval = keyframeInterval
+        # (kind, index, entityKeys, positions, values), positions is None for keyframes
+        self.frames = []
+        self.frameBlocks = []
+        self.byBlock = {}
+        self.sinceKeyframe = 0
+        # Full values of the latest frame, deltas are taken against it
+        self.last = None
+        # (plan, raw outputs) of the latest frame when it was a lazy snap
+        self.lastOutputs = None
+        self.rebuilt = None
+
+    # ===== SnapStore =====
+
+    def put(self, snap: Snap):
+        self.byBlock[snap.block] = len(self.frames)
+        self.frames.append(self.encode(snap.index, snap.entityKeys, snap.values))
+        self.frameBlocks.append(snap.block)
+
+    def encode(self, index, entityKeys, values):
+        previous = self.frames[-1] if self.frames else None
+        outputs = (values.plan, values.outputs) if undecoded(values) else None
+        if (
+            previous is None
+            or previous[1] is not index
+            or self.sinceKeyframe + 1 >= self.keyframeInterval
+        ):
+            current = list(values)
+            frame = (KEYFRAME, index, entityKeys, None, tuple(current))
+            self.sinceKeyframe = 0
+        else:
+            current = self.current_values(values, outputs)
+            changed = [i for i, (a, b) in enumerate(zip(self.last, current)) if a != b]
+            frame = (
+                DELTA,
+                index,
+                entityKeys,
+                tuple(changed),
+                tuple(current[i] for i in changed),
+            )
+            self.sinceKeyframe += 1
+        self.last = current
+        self.lastOutputs = outputs
+        return frame
+
+    def current_values(self, values, outputs):
+        """
+        Full values of the snap being put. For a lazy snap read with the same plan as the
+        latest frame, values of calls whose raw output is unchanged are taken from it
+        """
+        if (
+            outputs is None
+            or self.lastOutputs is None
+            or outputs[0] is not self.lastOutputs[0]
+        ):
+            return list(values)
+        moved = {
+            i
+            for i, (a, b) in enumerate(zip(outputs[1], self.lastOutputs[1]))
+            # CallFailure and other decoded outputs are always read again
+            if not isinstance(a, (bytes, memoryview)) or a != b
+        }
+        current = list(self.last)
+        for position, i in enumerate(values.plan.sources):
+            if i in moved:
+                current[position] = values[position]
+        return current
+
+    def get(self, block) -> Snap:
+        frameId = self.byBlock[block]
+        if self.rebuilt is not None and self.rebuilt[0] == frameId:
+            values = list(self.rebuilt[1])
+        else:
+            values = self.values_at(frameId)
+            self.rebuilt = (frameId, values)
+            values = list(values)
+        kind, index, entityKeys, positions, frameValues = self.frames[frameId]
+        return Snap.from_values(index, values, block, entityKeys)
+
+    def values_at(self, frameId):
+        """
+        Walk back to the closest keyframe and replay deltas forward
+        """
+        start = frameId
+        while self.frames[start][0] == DELTA:
+            start -= 1
+        values = list(self.frames[start][4])
+        for kind, index, entityKeys, positions, frameValues in self.frames[
+            start + 1 : frameId + 1
+        ]:
+            for position, value in zip(positions, frameValues):
+                values[position] = value
+        return values
+
+    def blocks(self):
+        return sorted(self.byBlock.keys())
+
+    def __contains__(self, block):
+        return block in self.byBlock
+
+    def __len__(self):
+        return len(self.byBlock)
+
+    # ===== dict of snaps =====
+
+    def __setitem__(self, block, snap: Snap):
+        if snap.block != block:
+            snap = Snap.from_values(snap.index, snap.values, block, snap.entityKeys)
+        self.put(snap)
+
+    def __getitem__(self, block):
+        return self.get(block)
+
+    def __iter__(self):
+        return iter(self.blocks())
+
+    def keys(self):
+        return self.blocks()
+
+    def values(self):
+        return [self.get(block) for block in self.blocks()]
+
+    def items(self):
+        return [(block, self.get(block)) for block in self.blocks()]
+
+    # ===== Size =====
+
+    def stored_values(self):
+        """
+        Number of values actually held, against len(self) * keys for plain snaps
+        """
+        return sum(len(frame[4]) for frame in self.frames)
+
+    # ===== Disk =====
+
+    def save(self, path):
+        indexes = []
+        indexIds = {}
+        frames = []
+        for kind, index, entityKeys, positions, values in self.frames:
+            if id(index) not in indexIds:
+                indexIds[id(index)] = len(indexes)
+                indexes.append(list(index.keys))
+            frames.append(
+                [
+                    kind,
+                    indexIds[id(index)],
+                    list(entityKeys),
+                    None if positions is None else list(positions),
+                    [encode_value(value) for value in values],
+                ]
+            )
+        with open(path, "w") as f:
+            json.dump(
+                {
+                    "keyframeInterval": self.keyframeInterval,
+                    "indexes": indexes,
+                    "blocks": self.frameBlocks,
+                    "frames": frames,
+                },
+                f,
+            )
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            saved = json.load(f)
+        history = cls(saved["keyframeInterval"])
+        indexes = [KeyIndex.intern(keys) for keys in saved["indexes"]]
+        for block, (kind, indexId, entityKeys, positions, values) in zip(
+            saved["blocks"], saved["frames"]
+        ):
+            history.byBlock[block] = len(history.frames)
+            history.frames.append(
+                (
+                    kind,
+                    indexes[indexId],
+                    entityKeys,
+                    None if positions is None else tuple(positions),
+                    tuple(values),
+                )
+            )
+            history.frameBlocks.append(block)
+            history.sinceKeyframe = 0 if kind == KEYFRAME else history.sinceKeyframe + 1
+        if history.frames:
+            history.last = history.values_at(len(history.frames) - 1)
+        return history
+
+
+def undecoded(values):
+    """
+    True for a LazyValues with values left to decode
+    """
+    return bool(getattr(values, "pending", 0))
@@ -0,0 +1,50 @@
+"""
+Deferred report rendering.
+
+Reports are passed to the logger wrapped in `Lazy`, so tables and JSON are only built
+when a handler actually emits the record. The dict forms are the structured output,
+values keep exact ints and failed reads become strings once dumped.
+"""
+
+import json
+
+from helpers.snapshot.diff import SnapDiff
+from helpers.snapshot.snap import Snap
+
+
+class Lazy:
+    """
+    Log argument rendered by `fn()` on first use, e.g. logger.info("%s", Lazy(render))
+    """
+
+    __slots__ = ("fn", "text")
+
+    def __init__(self, fn):
+        self.fn = fn
+        self.text = None
+
+    def __str__(self):
+        if self.text is None:
+            self.text = str(self.fn())
+        return self.text
+
+
+def compare_report(diff: SnapDiff, step=0):
+    rows = diff.rows(step)
+    return {
+        "before": int(diff.blocks[step]),
+        "after": int(diff.blocks[step + 1]),
+        "changes": {
+            key: {"before": before, "after": after, "diff": delta}
+            for key, before, after, delta in rows
+        },
+    }
+
+
+def snap_report(snap: Snap, keys=None):
+    keys = snap.index.keys if keys is None else keys
+    return {"block": snap.block, "values": {key: snap.get(key) for key in keys}}
+
+
+def as_json(report):
+    return json.dumps(report, indent=2, default=str)
@@ -1,23 +1,86 @@
+from weakref import WeakValueDictionary
+
+
+class KeyIndex:
+    """
+    Ordered snap keys and their positions, shared by every snap of the same call plan
+    """
+
+    __slots__ = ("keys", "positions", "__weakref__")
+
+    interned = WeakValueDictionary()
+
+    def __init__(self, keys):
+        self.keys = tuple(keys)
+        self.positions = {key: i for i, key in enumerate(self.keys)}
+
+    @classmethod
+    def intern(cls, keys):
+        keys = tuple(keys)
+        index = cls.interned.get(keys)
+        if index is None:
+            index = cls(keys)
+            cls.interned[keys] = index
+        return index
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self.positions
+
+
 class Snap:
+    """
+    Values of one snapshot, stored as a flat list aligned with a shared KeyIndex
+    `values` may also be a LazyValues that decodes each field on first read
+    """
+
+    __slots__ = ("index", "values", "block", "entityKeys")
+
     def __init__(self, data, block, entityKeys):
-        self.data = data
+        self.index = KeyIndex.intern(data.keys())
+        self.values = list(data.values())
         self.block = block
         self.entityKeys = entityKeys
 
+    @classmethod
+    def from_values(cls, index: KeyIndex, values, block, entityKeys):
+        snap = cls.__new__(cls)
+        snap.index = index
+        snap.values = values
+        snap.block = block
+        snap.entityKeys = entityKeys
+        return snap
+
+    @property
+    def data(self):
+        return dict(zip(self.index.keys, self.values))
+
     # ===== Getters =====
 
     def balances(self, tokenKey, accountKey):
-        return self.data["balances." + tokenKey + "." + accountKey]
+        return self.values[
+            self.index.positions["balances." + tokenKey + "." + accountKey]
+        ]
 
     def shares(self, tokenKey, accountKey):
-        return self.data["shares." + tokenKey + "." + accountKey]
+        return self.values[
+            self.index.positions["shares." + tokenKey + "." + accountKey]
+        ]
 
     def get(self, key):
-        if key not in self.data.keys():
+        position = self.index.positions.get(key)
+        if position is None:
             raise Exception("Key {} not found in snap data".format(key))
-        return self.data[key]
+        return self.values[position]
 
     # ===== Setters =====
 
     def set(self, key, value):
-        self.data[key] = value
+        position = self.index.positions.get(key)
+        if position is None:
+            self.index = KeyIndex.intern(self.index.keys + (key,))
+            self.values.append(value)
+        else:
+            self.values[position] = value
@@ -0,0 +1,334 @@
+"""
+Snapshot stores, keyed by block.
+
+- MemorySnapStore: plain dict, gone with the process
+- JsonLinesSnapStore: append-only JSON lines, easy to grep and diff
+- ColumnarSnapStore: one memory-mapped file per key, whole metrics load as NumPy arrays
+- SqliteSnapStore: single file, key sets may change between snaps
+
+Every store answers range queries by block and exports a key as a column:
+`store.column("sett.pricePerFullShare", start, end)` returns (blocks, values) arrays.
+"""
+
+import json
+import os
+import sqlite3
+
+import numpy as np
+
+from helpers.snapshot.snap import KeyIndex, Snap
+
+WORD = 32
+
+
+class SnapStore:
+    """
+    Where snaps end up once taken, keyed by block
+    """
+
+    def put(self, snap: Snap):
+        raise NotImplementedError
+
+    def get(self, block) -> Snap:
+        raise NotImplementedError
+
+    def blocks(self):
+        """
+        Sorted list of stored blocks
+        """
+        raise NotImplementedError
+
+    def __contains__(self, block):
+        return block in self.blocks()
+
+    def __len__(self):
+        return len(self.blocks())
+
+    def between(self, start=None, end=None):
+        """
+        Snaps with start <= block <= end, in block order
+        """
+        for block in self.blocks():
+            if (start is None or block >= start) and (end is None or block <= end):
+                yield self.get(block)
+
+    def column(self, key, start=None, end=None):
+        """
+        (blocks, values) arrays for one key, values keep exact Python ints
+        """
+        blocks = []
+        values = []
+        for snap in self.between(start, end):
+            if key in snap.index:
+                blocks.append(snap.block)
+                values.append(snap.get(key))
+        return np.array(blocks, dtype=np.int64), np.array(values, dtype=object)
+
+
+class MemorySnapStore(SnapStore):
+    def __init__(self):
+        self.snaps = {}
+
+    def put(self, snap: Snap):
+        self.snaps[snap.block] = snap
+
+    def get(self, block) -> Snap:
+        return self.snaps[block]
+
+    def blocks(self):
+        return sorted(self.snaps.keys())
+
+    def __contains__(self, block):
+        return block in self.snaps
+
+
+class JsonLinesSnapStore(MemorySnapStore):
+    """
+    Append-only file, one JSON object per snap, reloaded on start
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        row = json.loads(line)
+                        super().put(Snap(row["data"], row["block"], row["entityKeys"]))
+
+    def put(self, snap: Snap):
+        with open(self.path, "a") as f:
+            f.write(
+                json.dumps(
+                    {
+                        "block": snap.block,
+                        "entityKeys": snap.entityKeys,
+                        "data": {
+                            key: encode_value(value) for key, value in snap.data.items()
+                        },
+                    }
+                )
+                + "\n"
+            )
+        super().put(snap)
+
+
+def to_words(value):
+    if isinstance(value, bool):
+        value = int(value)
+    if not isinstance(value, int):
+        raise TypeError("columnar store only holds integers, got {!r}".format(value))
+    return value.to_bytes(WORD, "big")
+
+
+def words_to_float(words):
+    """
+    (n, 32) uint8 big-endian words to float64, vectorized
+    """
+    limbs = np.ascontiguousarray(words).view(">u8").reshape(-1, 4).astype(np.float64)
+    values = limbs[:, 0]
+    for i in range(1, 4):
+        values = values * 2.0 ** 64 + limbs[:, i]
+    return values
+
+
+class ColumnarSnapStore(SnapStore):
+    """
+    Append-only directory with one file per key of 32 byte big-endian words and an int64
+    block file, read back through np.memmap. The key set is fixed by the first snap:
+    use one store per call plan
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.meta = os.path.join(directory, "keys.json")
+        self.index = None
+        self.entityKeys = []
+        self.size = 0
+        self.positions = {}
+        if os.path.exists(self.meta):
+            with open(self.meta) as f:
+                meta = json.load(f)
+            self.index = KeyIndex.intern(meta["keys"])
+            self.entityKeys = meta["entityKeys"]
+            blocks = self.path("blocks")
+            self.size = os.path.getsize(blocks) // 8 if os.path.exists(blocks) else 0
+            # Drop a row whose columns were written but whose block was not, files not
+            # written yet (a crash before the first row completed) come back empty
+            for i in range(len(self.index)):
+                with open(self.path(i), "ab") as f:
+                    f.truncate(self.size * WORD)
+            for row, block in enumerate(self.block_column()):
+                self.positions[int(block)] = row
+
+    def path(self, column):
+        return os.path.join(self.directory, "{}.bin".format(column))
+
+    def put(self, snap: Snap):
+        if self.index is not None and snap.index.keys != self.index.keys:
+            raise ValueError(
+                "snap keys differ from the store's, use one store per plan"
+            )
+        # Checked before anything is written, a rejected first snap leaves no metadata
+        words = [to_words(value) for value in snap.values]
+        if self.index is None:
+            self.index = KeyIndex.intern(snap.index.keys)
+            self.entityKeys = list(snap.entityKeys)
+            with open(self.meta, "w") as f:
+                json.dump({"keys": self.index.keys, "entityKeys": self.entityKeys}, f)
+
+        for i, word in enumerate(words):
+            with open(self.path(i), "ab") as f:
+                f.write(word)
+        # The block is written last, it marks the row as complete
+        with open(self.path("blocks"), "ab") as f:
+            f.write(np.int64(snap.block).tobytes())
+        self.positions[snap.block] = self.size
+        self.size += 1
+
+    def block_column(self):
+        if self.size == 0:
+            return np.zeros(0, dtype=np.int64)
+        return np.memmap(
+            self.path("blocks"), dtype=np.int64, mode="r", shape=(self.size,)
+        )
+
+    def words(self, key):
+        """
+        Memory-mapped (rows, 32) uint8 view of a key's column
+        """
+        if self.size == 0:
+            return np.zeros((0, WORD), dtype=np.uint8)
+        return np.memmap(
+            self.path(self.index.positions[key]),
+            dtype=np.uint8,
+            mode="r",
+            shape=(self.size, WORD),
+        )
+
+    def get(self, block) -> Snap:
+        row = self.positions[block]
+        values = [
+            int.from_bytes(self.words(key)[row].tobytes(), "big")
+            for key in self.index.keys
+        ]
+        return Snap.from_values(self.index, values, block, self.entityKeys)
+
+    def blocks(self):
+        return sorted(self.positions.keys())
+
+    def __contains__(self, block):
+        return block in self.positions
+
+    def rows(self, start=None, end=None):
+        """
+        Row numbers of the latest snap for each block in range, in block order
+        """
+        blocks = np.asarray(self.block_column())
+        rows = np.array(sorted(self.positions.values()), dtype=np.int64)
+        rows = rows[np.argsort(blocks[rows], kind="stable")]
+        mask = np.ones(len(rows), dtype=bool)
+        if start is not None:
+            mask &= blocks[rows] >= start
+        if end is not None:
+            mask &= blocks[rows] <= end
+        return rows[mask]
+
+    def column(self, key, start=None, end=None, dtype=object):
+        """
+        dtype=object keeps exact ints, dtype=float converts every row in one vectorized pass
+        """
+        rows = self.rows(start, end)
+        blocks = np.asarray(self.block_column())[rows]
+        words = np.asarray(self.words(key))[rows]
+        if dtype is object:
+            values = np.array(
+                [int.from_bytes(word.tobytes(), "big") for word in words], dtype=object
+            )
+        else:
+            values = words_to_float(words).astype(dtype)
+        return blocks, values
+
+
+class SqliteSnapStore(SnapStore):
+    """
+    One row per (block, key), values stored as JSON text so uint256 stays exact
+    """
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS snaps (block INTEGER PRIMARY KEY, entityKeys TEXT);
+            CREATE TABLE IF NOT EXISTS snapValues (
+                block INTEGER, key TEXT, value TEXT, PRIMARY KEY (key, block)
+            );
+            """
+        )
+
+    def put(self, snap: Snap):
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO snaps VALUES (?, ?)",
+                (snap.block, json.dumps(list(snap.entityKeys))),
+            )
+            self.db.execute("DELETE FROM snapValues WHERE block = ?", (snap.block,))
+            self.db.executemany(
+                "INSERT INTO snapValues VALUES (?, ?, ?)",
+                [
+                    (snap.block, key, json.dumps(encode_value(value)))
+                    for key, value in zip(snap.index.keys, snap.values)
+                ],
+            )
+
+    def get(self, block) -> Snap:
+        row = self.db.execute(
+            "SELECT entityKeys FROM snaps WHERE block = ?", (block,)
+        ).fetchone()
+        if row is None:
+            raise KeyError(block)
+        data = {
+            key: json.loads(value)
+            for key, value in self.db.execute(
+                "SELECT key, value FROM snapValues WHERE block = ? ORDER BY rowid",
+                (block,),
+            )
+        }
+        return Snap(data, block, json.loads(row[0]))
+
+    def blocks(self):
+        return [
+            block
+            for (block,) in self.db.execute("SELECT block FROM snaps ORDER BY block")
+        ]
+
+    def __contains__(self, block):
+        return (
+            self.db.execute("SELECT 1 FROM snaps WHERE block = ?", (block,)).fetchone()
+            is not None
+        )
+
+    def column(self, key, start=None, end=None):
+        rows = self.db.execute(
+            "SELECT block, value FROM snapValues WHERE key = ? AND block >= ? AND block <= ? "
+            "ORDER BY block",
+            (
+                key,
+                -(2 ** 63) if start is None else start,
+                2 ** 63 - 1 if end is None else end,
+            ),
+        ).fetchall()
+        blocks = np.array([block for block, value in rows], dtype=np.int64)
+        values = np.array([json.loads(value) for block, value in rows], dtype=object)
+        return blocks, values
+
+
+def encode_value(value):
+    """
+    JSON friendly value, failed reads are stored as null
+    """
+    if isinstance(value, (bool, int, str)) or value is None:
+        return value
+    return None
@@ -1,11 +1,9 @@
-# Assert approximate integer
+from helpers.fixedpoint import close
+
+
+# Assert approximate integer, helpers.fixedpoint.mismatches() says by how much
 def approx(actual, expected, percentage_threshold):
-    print(actual, expected, percentage_threshold)
-    diff = int(abs(actual - expected))
-    # 0 diff should automtically be a match
-    if diff == 0:
-        return True
-    return diff < (actual * percentage_threshold // 100)
+    return close(actual, expected, percentage_threshold)
 
 
 def val(amount=0, decimals=18, token=None):
@@ -0,0 +1,215 @@
+"""
+Batch verification of recorded transitions.
+
+Transitions are grouped by action, evaluated against the resolver's rule sets in chunks of
+`chunksize` (one vectorized pass per chunk) and the chunks are spread over a process pool.
+Nothing raises: every failing rule is collected with its context into a report.
+
+    verifier = BatchVerifier.from_resolver(manager.resolver, workers=8)
+    report = verifier.verify(transitions)
+    print(report.summary())
+"""
+
+import json
+import os
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from tabulate import tabulate
+
+from helpers.invariants import SnapPair, Transitions
+from helpers.snapshot.snap import Snap
+
+
+class Transition:
+    """
+    One recorded action: the snaps around it, its params and optionally its receipt
+    """
+
+    __slots__ = ("action", "before", "after", "params", "txid")
+
+    def __init__(self, action, before: Snap, after: Snap, params=None, receipt=None):
+        self.action = action
+        self.before = plain(before)
+        self.after = plain(after)
+        self.params = params or {}
+        # Receipts do not pickle, only the hash travels to the workers
+        self.txid = getattr(receipt, "txid", receipt)
+
+
+def plain(snap: Snap):
+    """
+    Snap with decoded values, lazy snaps hold a call plan that cannot be pickled
+    """
+    return Snap.from_values(snap.index, list(snap.values), snap.block, snap.entityKeys)
+
+
+def failure(action, rule, transition: Transition, error=None):
+    values = {}
+    for key in rule.keys():
+        values[key] = [
+            snap.values[snap.index.positions[key]] if key in snap.index else None
+            for snap in (transition.before, transition.after)
+        ]
+    return {
+        "action": action,
+        "rule": rule.name,
+        "before": transition.before.block,
+        "after": transition.after.block,
+        "txid": transition.txid,
+        "params": transition.params,
+        "values": values,
+        "error": error,
+    }
+
+
+def verify_chunk(action, ruleSet, chunk):
+    """
+    Failures in a chunk of transitions sharing action and param names, runs in a worker
+    """
+    rules = ruleSet.guarded()
+    try:
+        names = chunk[0].params.keys()
+        params = {
+            name: np.array([t.params[name] for t in chunk], dtype=object)
+            for name in names
+        }
+        env = Transitions.from_pairs([(t.before, t.after) for t in chunk], params)
+        results = [(rule, rule.evaluate(env)) for rule in rules]
+    except Exception:
+        # A missing key or param somewhere in the chunk, isolate it transition by transition
+        return [
+            found
+            for transition in chunk
+            for found in verify_one(action, rules, transition)
+        ]
+    return [
+        failure(action, rule, chunk[row])
+        for rule, passed in results
+        for row in np.flatnonzero(~passed)
+    ]
+
+
+def verify_one(action, rules, transition: Transition):
+    env = SnapPair(transition.before, transition.after, transition.params)
+    found = []
+    for rule in rules:
+        try:
+            if not rule.evaluate(env):
+                found.append(failure(action, rule, transition))
+        except Exception as e:
+            found.append(failure(action, rule, transition, error=repr(e)))
+    return found
+
+
+class VerificationReport:
+    def __init__(self, total, failures, elapsed):
+        self.total = total
+        self.failures = failures
+        self.elapsed = elapsed
+
+    @property
+    def ok(self):
+        return not self.failures
+
+    def failed_transitions(self):
+        return len({(f["action"], f["before"], f["after"]) for f in self.failures})
+
+    def as_dict(self):
+        return {
+            "transitions": self.total,
+            "failedTransitions": self.failed_transitions(),
+            "elapsedSeconds": self.elapsed,
+            "failures": self.failures,
+        }
+
+    def to_json(self, path=None):
+        data = json.dumps(self.as_dict(), indent=2, default=str)
+        if path:
+            with open(path, "w") as f:
+                f.write(data)
+        return data
+
+    def summary(self):
+        counts = Counter((f["action"], f["rule"]) for f in self.failures)
+        first = {}
+        for f in self.failures:
+            first.setdefault((f["action"], f["rule"]), f["after"])
+        table = [
+            [action, rule, count, first[(action, rule)]]
+            for (action, rule), count in sorted(counts.items())
+        ]
+        header = "{} transitions, {} failed, {:.1f}s".format(
+            self.total, self.failed_transitions(), self.elapsed
+        )
+        if not table:
+            return header
+        return (
+            header
+            + "\n"
+            + tabulate(table, headers=["action", "rule", "failures", "first block"])
+        )
+
+
+class BatchVerifier:
+    def __init__(self, rules, workers=None, chunksize=256):
+        """
+        rules: {action: RuleSet}, workers=1 verifies in this process
+        """
+        self.rules = rules
+        self.workers = workers or os.cpu_count()
+        self.chunksize = chunksize
+
+    @classmethod
+    def from_resolver(cls, resolver, **kwargs):
+        actions = set(resolver.actionRules) | set(resolver.hookRules)
+        return cls({action: resolver.rules(action) for action in actions}, **kwargs)
+
+    def chunks(self, transitions):
+        groups = defaultdict(list)
+        for transition in transitions:
+            key = (transition.action, tuple(sorted(transition.params)))
+            groups[key].append(transition)
+        for (action, names), group in groups.items():
+            for start in range(0, len(group), self.chunksize):
+                yield action, group[start : start + self.chunksize]
+
+    def verify(self, transitions) -> VerificationReport:
+        start = time.perf_counter()
+        transitions = list(transitions)
+        failures = []
+        unknown = [t for t in transitions if t.action not in self.rules]
+        for transition in unknown:
+            failures.append(
+                {
+                    "action": transition.action,
+                    "rule": "unknown action",
+                    "before": transition.before.block,
+                    "after": transition.after.block,
+                    "txid": transition.txid,
+                    "params": transition.params,
+                    "values": {},
+                    "error": None,
+                }
+            )
+        tasks = [
+            (action, self.rules[action], chunk)
+            for action, chunk in self.chunks(
+                t for t in transitions if t.action in self.rules
+            )
+        ]
+
+        if self.workers == 1 or len(tasks) <= 1:
+            results = [verify_chunk(*task) for task in tasks]
+        else:
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                results = list(pool.map(verify_chunk, *zip(*tasks)))
+
+        for found in results:
+            failures.extend(found)
+        failures.sort(key=lambda f: (f["after"], f["action"], f["rule"]))
+        return VerificationReport(
+            len(transitions), failures, time.perf_counter() - start
+        )
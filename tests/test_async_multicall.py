@@ -0,0 +1,153 @@
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from eth_abi import decode_single, encode_single
+from eth_utils import function_signature_to_4byte_selector
+
+from helpers.multicall import CallFailure, func
+from helpers.multicall.aio import AsyncCall, AsyncMulticall, AsyncRPC
+from helpers.multicall.constants import MULTICALL_ADDRESSES, MULTICALL2_ADDRESSES
+
+"""
+  AsyncMulticall against a pure-Python JSON-RPC stand-in, no node required
+"""
+
+TOKEN = "0x1111111111111111111111111111111111111111"
+USERS = ["0x{:040x}".format(i) for i in range(1, 41)]
+
+AGGREGATE = function_signature_to_4byte_selector("aggregate((address,bytes)[])")
+TRY_AGGREGATE = function_signature_to_4byte_selector(
+    "tryAggregate(bool,(address,bytes)[])"
+)
+BALANCE_OF = function_signature_to_4byte_selector("balanceOf(address)")
+TOTAL_SUPPLY = function_signature_to_4byte_selector("totalSupply()")
+
+
+def balance(user):
+    return int(user, 16) * 10 ** 18
+
+
+def view(target, data):
+    """
+    The token only answers balanceOf, anything else reverts
+    """
+    if target.lower() == TOKEN and data[:4] == BALANCE_OF:
+        (user,) = decode_single("(address)", data[4:])
+        return encode_single("(uint256)", [balance(user)])
+    raise ValueError("unknown call")
+
+
+class StandInNode(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    connections = set()
+    requests = 0
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        StandInNode.connections.add(self.client_address)
+        StandInNode.requests += 1
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        result = getattr(self, body["method"])(*body["params"])
+        payload = json.dumps({"jsonrpc": "2.0", "id": body["id"], "result": result})
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload.encode())
+
+    def eth_chainId(self):
+        return hex(42161)
+
+    def eth_call(self, tx, block):
+        data = bytes.fromhex(tx["data"][2:])
+        if data[:4] == AGGREGATE:
+            (calls,) = decode_single("((address,bytes)[])", data[4:])
+            outputs = [view(target, calldata) for target, calldata in calls]
+            output = encode_single("(uint256,bytes[])", [1, outputs])
+        elif data[:4] == TRY_AGGREGATE:
+            requireSuccess, calls = decode_single("(bool,(address,bytes)[])", data[4:])
+            results = []
+            for target, calldata in calls:
+                try:
+                    results.append((True, view(target, calldata)))
+                except ValueError:
+                    results.append((False, b""))
+            output = encode_single("((bool,bytes)[])", [results])
+        else:
+            output = view(tx["to"], data)
+        return "0x" + output.hex()
+
+
+def start_node():
+    StandInNode.connections = set()
+    StandInNode.requests = 0
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInNode)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, "http://127.0.0.1:{}".format(server.server_address[1])
+
+
+def balance_calls():
+    return [
+        AsyncCall(TOKEN, [func.erc20.balanceOf, user], [["balances." + user, None]])
+        for user in USERS
+    ]
+
+
+def test_async_call():
+    server, url = start_node()
+
+    async def run():
+        async with AsyncRPC(url) as rpc:
+            call = AsyncCall(TOKEN, [func.erc20.balanceOf, USERS[2]])
+            return await call(rpc)
+
+    assert asyncio.run(run()) == balance(USERS[2])
+    server.shutdown()
+
+
+def test_concurrent_multicalls_share_one_session():
+    server, url = start_node()
+    address = MULTICALL_ADDRESSES[42161]
+
+    async def run():
+        async with AsyncRPC(url, limit=4) as rpc:
+            multis = [
+                AsyncMulticall(balance_calls(), max_calls=10, address=address)
+                for _ in range(5)
+            ]
+            return await asyncio.gather(*[multi(rpc) for multi in multis]), rpc
+
+    results, rpc = asyncio.run(run())
+
+    for result in results:
+        assert result == {"balances." + user: balance(user) for user in USERS}
+    # 5 multicalls of 4 chunks each, over at most `limit` keep-alive connections
+    assert rpc.requests == 20
+    assert StandInNode.requests == 20
+    assert len(StandInNode.connections) <= 4
+    server.shutdown()
+
+
+def test_try_aggregate_isolates_failures():
+    server, url = start_node()
+    calls = balance_calls()[:3] + [
+        AsyncCall(TOKEN, [func.erc20.totalSupply], [["totalSupply", None]])
+    ]
+
+    async def run():
+        async with AsyncRPC(url) as rpc:
+            multi = AsyncMulticall(calls, require_success=False, retries=1)
+            return await multi(rpc), multi.address
+
+    result, address = asyncio.run(run())
+
+    assert address == MULTICALL2_ADDRESSES[42161]
+    assert result["balances." + USERS[0]] == balance(USERS[0])
+    assert isinstance(result["totalSupply"], CallFailure)
+    # One chain id lookup, the batch, then one retry of the failed call only
+    assert StandInNode.requests == 3
+    server.shutdown()
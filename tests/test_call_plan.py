@@ -0,0 +1,175 @@
+import pytest
+from eth_abi import decode_single, encode_single
+from eth_abi.exceptions import DecodingError
+from eth_utils import function_signature_to_4byte_selector
+
+import helpers.multicall.call as call_module
+from helpers.multicall import Call, CallFailure, Multicall, func
+from helpers.multicall.plan import CallPlan
+
+"""
+  Sync CallPlan against an in-process stand-in for web3.eth.call, no node required
+"""
+
+TOKEN = "0x1111111111111111111111111111111111111111"
+MULTICALL = "0x2222222222222222222222222222222222222222"
+USERS = ["0x{:040x}".format(i) for i in range(1, 41)]
+
+AGGREGATE = function_signature_to_4byte_selector("aggregate((address,bytes)[])")
+TRY_AGGREGATE = function_signature_to_4byte_selector(
+    "tryAggregate(bool,(address,bytes)[])"
+)
+BALANCE_OF = function_signature_to_4byte_selector("balanceOf(address)")
+TOTAL_SUPPLY = function_signature_to_4byte_selector("totalSupply()")
+NAME = function_signature_to_4byte_selector("name()")
+DECIMALS = function_signature_to_4byte_selector("decimals()")
+
+
+def balance(user):
+    return int(user, 16) * 10 ** 18 + 2 ** 200
+
+
+class StandInEth:
+    """
+    The token answers balanceOf and name, decimals succeeds without return data and
+    totalSupply reverts `flaky` times before answering
+    """
+
+    def __init__(self, flaky=0, output=None):
+        self.flaky = flaky
+        self.output = output
+        # Calls inside each aggregate sent
+        self.batches = []
+
+    def view(self, target, data):
+        if target.lower() != TOKEN:
+            raise ValueError("no code")
+        if data[:4] == BALANCE_OF:
+            (user,) = decode_single("(address)", data[4:])
+            return encode_single("(uint256)", [balance(user)])
+        if data[:4] == NAME:
+            return encode_single("(string)", ["Token"])
+        if data[:4] == DECIMALS:
+            return b""
+        if data[:4] == TOTAL_SUPPLY and self.flaky == 0:
+            return encode_single("(uint256)", [10 ** 24])
+        self.flaky -= 1
+        raise ValueError("reverted")
+
+    def call(self, tx, block_identifier=None):
+        if self.output is not None:
+            return self.output
+        data = tx["data"]
+        if data[:4] == AGGREGATE:
+            (calls,) = decode_single("((address,bytes)[])", data[4:])
+            self.batches.append(len(calls))
+            outputs = [self.view(target, calldata) for target, calldata in calls]
+            return encode_single("(uint256,bytes[])", [7, outputs])
+        requireSuccess, calls = decode_single("(bool,(address,bytes)[])", data[4:])
+        self.batches.append(len(calls))
+        results = []
+        for target, calldata in calls:
+            try:
+                results.append((True, self.view(target, calldata)))
+            except ValueError:
+                results.append((False, b""))
+        return encode_single("((bool,bytes)[])", [results])
+
+
+@pytest.fixture
+def eth(monkeypatch):
+    eth = StandInEth()
+    monkeypatch.setattr(call_module, "web3", type("Web3", (), {"eth": eth}))
+    return eth
+
+
+def balance_calls(users=USERS):
+    return [
+        Call(TOKEN, [func.erc20.balanceOf, user], [["balances." + user, None]])
+        for user in users
+    ]
+
+
+def expected(users=USERS):
+    return {"balances." + user: balance(user) for user in users}
+
+
+@pytest.mark.parametrize(
+    "budget", [{"max_calls": 10}, {"max_bytes": 1500}, {"max_gas": 300000}],
+)
+def test_budget_chunking(eth, budget):
+    plan = CallPlan(balance_calls(), address=MULTICALL, **budget)
+
+    assert len(plan.chunks) > 1
+    assert sum(len(chunk) for chunk in plan.chunks) == len(USERS)
+    assert plan() == expected()
+    assert sorted(eth.batches) == sorted(len(chunk) for chunk in plan.chunks)
+
+
+def test_duplicates_fan_out_across_chunks(eth):
+    twice = balance_calls(USERS[:5]) + [
+        Call(TOKEN, [func.erc20.balanceOf, user], [["again." + user, None]])
+        for user in USERS[:5]
+    ]
+    plan = CallPlan(twice, address=MULTICALL, max_calls=2)
+
+    assert plan.saved == 5
+    assert sum(eth.batches) == 0
+    result = plan()
+    assert sum(eth.batches) == 5
+    for user in USERS[:5]:
+        assert result["balances." + user] == result["again." + user] == balance(user)
+
+
+def test_uint256_fast_path_matches_eth_abi(eth):
+    calls = balance_calls(USERS[:3]) + [
+        Call(TOKEN, [func.erc20.name], [["name", None]]),
+        Call(TOKEN, [func.erc20.balanceOf, USERS[3]], [["last", str]]),
+    ]
+    plan = CallPlan(calls, address=MULTICALL)
+    outputs = plan.fetch()
+    generic = {}
+    for call, output in zip(plan.unique, outputs):
+        generic.update(call.decode_output(bytes(output)))
+
+    assert [fast for start, end, fast in plan.runs] == [True, False, True]
+    assert plan.decode(outputs) == generic
+    assert generic["last"] == str(balance(USERS[3]))
+
+
+def test_short_output_falls_back_to_the_generic_decoder(eth):
+    calls = balance_calls(USERS[:2]) + [
+        Call(TOKEN, [func.erc20.decimals], [["decimals", None]])
+    ]
+    result = Multicall(calls, address=MULTICALL, require_success=False)()
+    assert result["balances." + USERS[0]] == balance(USERS[0])
+    assert isinstance(result["decimals"], CallFailure)
+
+    with pytest.raises(DecodingError):
+        Multicall(calls, address=MULTICALL)()
+
+
+def test_try_aggregate_retries_only_the_failures(eth):
+    eth.flaky = 1
+    calls = balance_calls(USERS[:3]) + [
+        Call(TOKEN, [func.erc20.totalSupply], [["totalSupply", None]]),
+        Call(USERS[0], [func.erc20.totalSupply], [["noCode", None]]),
+    ]
+    result = Multicall(calls, address=MULTICALL, require_success=False, retries=2)()
+
+    assert result["totalSupply"] == 10 ** 24
+    assert isinstance(result["noCode"], CallFailure)
+    # The batch, then the two failures, then the one still failing
+    assert eth.batches == [5, 2, 1]
+
+
+def test_empty_return_data_raises(eth):
+    eth.output = b""
+    calls = [
+        Call(TOKEN, [func.erc20.totalSupply], [["totalSupply", None]]),
+        Call(TOKEN, [func.erc20.balanceOf, USERS[0]], [["balance", None]]),
+    ]
+    with pytest.raises(DecodingError):
+        Multicall(calls, address=MULTICALL)()
+    with pytest.raises(DecodingError):
+        Multicall(calls, address=MULTICALL, require_success=False)()
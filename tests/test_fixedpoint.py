@@ -0,0 +1,36 @@
+import numpy as np
+
+from helpers.fixedpoint import (
+    UNIT,
+    deposit_shares,
+    mismatches,
+    mul_div,
+    ppfs,
+    withdraw_amount,
+)
+
+
+def test_settv3_formulas_round_down():
+    assert mul_div(10, 10, 3) == 33
+    assert ppfs(0, 0) == UNIT
+    assert ppfs(2, 3) == 2 * UNIT // 3
+    assert deposit_shares(5, 0, 0) == 5
+    assert deposit_shares(10, 3, 7) == 23
+    assert withdraw_amount(7, 3, 10) == 2
+
+
+def test_vectorized_matches_scalar():
+    amounts = np.array([5, 10, 2 ** 150], dtype=object)
+    pools = np.array([0, 3, 2 ** 100], dtype=object)
+    supplies = np.array([0, 7, 2 ** 90], dtype=object)
+    shares = deposit_shares(amounts, pools, supplies)
+    assert shares.tolist() == [
+        deposit_shares(a, p, s) for a, p, s in zip(amounts, pools, supplies)
+    ]
+    assert ppfs(pools, supplies).tolist() == [UNIT, 3 * UNIT // 7, UNIT * 2 ** 10]
+
+
+def test_mismatches():
+    assert mismatches(1000, 1005, 1) == []
+    [found] = mismatches([1000, 100, 50], [1000, 90, 52], 1, tolerance=2)
+    assert (found.index, found.diff, found.allowed) == (1, 10, 1)
@@ -0,0 +1,40 @@
+import numpy as np
+
+from helpers.invariants import After, Before, Param, Rule, RuleSet, Transitions, approx
+from helpers.snapshot.snap import Snap
+
+RULES = RuleSet(
+    Rule(
+        "user pays",
+        approx(
+            After.balances("want", "user"),
+            Before.balances("want", "user") - Param("amount"),
+            1,
+        ),
+    ),
+    Rule(
+        "supply grows",
+        After("sett.totalSupply") > Before("sett.totalSupply"),
+        when=Param("amount") > 0,
+    ),
+)
+
+
+def snap(block, user, supply):
+    return Snap({"balances.want.user": user, "sett.totalSupply": supply}, block, [])
+
+
+def test_single_transition():
+    RULES.verify(snap(1, 100, 0), snap(2, 60, 40), {"amount": 40})
+    failed = RULES.failures(
+        Transitions.from_pairs([(snap(1, 100, 0), snap(2, 60, 0))], {"amount": 40})
+    )
+    assert failed["supply grows"].tolist() == [0]
+
+
+def test_history_in_one_pass():
+    history = [snap(1, 100, 0), snap(2, 60, 40), snap(3, 60, 40), snap(4, 10, 30)]
+    amounts = np.array([40, 0, 50], dtype=object)
+    failed = RULES.failures(Transitions.from_history(history, {"amount": amounts}))
+    assert list(failed) == ["supply grows"]
+    assert failed["supply grows"].tolist() == [2]
@@ -0,0 +1,100 @@
+import pytest
+
+import helpers.multicall.cache as cache_module
+import helpers.multicall.call as call_module
+from helpers.multicall import ResponseCache
+
+"""
+  eth_call response cache against a stand-in web3.eth, no node required
+"""
+
+TARGET = "0x00000000000000000000000000000000000000aa"
+CALLDATA = bytes.fromhex("18160ddd")
+
+
+class StandInEth:
+    chainId = 1
+
+    def __init__(self, head):
+        self.head = head
+        # Head lookups and eth_calls sent
+        self.heads = 0
+        self.calls = []
+
+    @property
+    def blockNumber(self):
+        self.heads += 1
+        return self.head
+
+    def call(self, tx, block_identifier=None):
+        self.calls.append(block_identifier)
+        return "output at {}".format(block_identifier).encode()
+
+
+@pytest.fixture
+def eth(monkeypatch):
+    eth = StandInEth(1000)
+    web3 = type("Web3", (), {"eth": eth})
+    monkeypatch.setattr(cache_module, "web3", web3)
+    monkeypatch.setattr(call_module, "web3", web3)
+    return eth
+
+
+def test_only_confirmed_blocks_are_final(eth):
+    cache = ResponseCache(confirmations=64)
+    assert cache.final(936)
+    assert not cache.final(937)
+    # Reading a later block moves the head without asking the node again
+    assert not cache.final(1100)
+    assert cache.final(1000)
+    assert eth.heads == 1
+
+
+def test_eth_call_caches_final_reads(eth):
+    cache = ResponseCache(confirmations=64)
+    for block in [900, 900, 999, 999, "latest", None]:
+        output = call_module.eth_call(TARGET, CALLDATA, block, cache)
+        assert output == "output at {}".format(block).encode()
+    assert eth.calls == [900, 999, 999, "latest", None]
+    assert cache.stats() == {"entries": 1, "bytes": 13, "hits": 1, "misses": 1}
+
+
+def test_least_recently_used_is_evicted(eth):
+    cache = ResponseCache(maxsize=2)
+    cache.put(1, TARGET, CALLDATA, b"a")
+    cache.put(2, TARGET, CALLDATA, b"b")
+    assert cache.get(1, TARGET, CALLDATA) == b"a"
+    cache.put(3, TARGET, CALLDATA, b"c")
+    assert cache.get(2, TARGET, CALLDATA) is None
+    assert cache.get(1, TARGET, CALLDATA) == b"a"
+    assert cache.get(3, TARGET, CALLDATA) == b"c"
+
+
+def test_maxbytes_bounds_the_return_data(eth):
+    cache = ResponseCache(maxbytes=10)
+    for block in range(4):
+        cache.put(block, TARGET, CALLDATA, bytes(4))
+    assert cache.stats()["entries"] == 2
+    assert cache.stats()["bytes"] == 8
+    assert cache.get(3, TARGET, CALLDATA) == bytes(4)
+    # A single response larger than the bound is still kept
+    cache.put(4, TARGET, CALLDATA, bytes(16))
+    assert cache.stats()["entries"] == 1
+    assert cache.get(4, TARGET, CALLDATA) == bytes(16)
+
+
+def test_sqlite_backing_survives_a_restart(eth, tmp_path):
+    path = str(tmp_path / "responses.db")
+    cache = ResponseCache(maxsize=1, path=path)
+    cache.put(1, TARGET, CALLDATA, b"one")
+    cache.put(2, TARGET, CALLDATA, b"two")
+    # Evicted from memory, read back from the file
+    assert cache.get(1, TARGET, CALLDATA) == b"one"
+
+    restarted = ResponseCache(path=path)
+    assert restarted.get(2, TARGET, CALLDATA) == b"two"
+    assert restarted.get(2, TARGET.upper().replace("0X", "0x"), CALLDATA) == b"two"
+    assert ResponseCache(path=path, chainId=42161).get(2, TARGET, CALLDATA) is None
+
+    restarted.clear()
+    assert ResponseCache(path=path).get(1, TARGET, CALLDATA) is None
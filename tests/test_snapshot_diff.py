@@ -0,0 +1,51 @@
+from helpers.multicall import CallFailure
+from helpers.snapshot.diff import SnapDiff, object_rows
+from helpers.snapshot.snap import Snap
+
+"""
+  SnapDiff layout and whole-array deltas, no node required
+"""
+
+FAILURE = CallFailure("0x1111111111111111111111111111111111111111", "f()", "reverted")
+
+
+def snap(block, **data):
+    return Snap(data, block, [])
+
+
+def test_tuple_values_stay_single_cells():
+    assert object_rows([[(1, 2), (3, 4)]], 2).tolist() == [[(1, 2), (3, 4)]]
+    assert object_rows([[(5,)]], 1).tolist() == [[(5,)]]
+    assert object_rows([], 3).shape == (0, 3)
+
+    diff = SnapDiff(
+        [
+            snap(1, balance=10, userInfo=(1, 2), paused=False),
+            snap(2, balance=15, userInfo=(1, 3), paused=True),
+        ]
+    )
+    assert diff.values.tolist() == [[10, (1, 2), False], [15, (1, 3), True]]
+    assert diff.numeric.tolist() == [[True, False, False], [True, False, False]]
+    assert diff.delta.tolist() == [[5, None, None]]
+    assert diff.changed_keys() == ["balance", "userInfo", "paused"]
+
+
+def test_snaps_with_different_keys():
+    diff = SnapDiff(
+        [
+            snap(1, a=1, b=2 ** 200),
+            snap(2, b=2 ** 200 + 1, c=FAILURE),
+            snap(3, a=4, b=2 ** 200 + 1),
+        ]
+    )
+    assert diff.keys == ["a", "b", "c"]
+    assert diff.values.tolist() == [
+        [1, 2 ** 200, None],
+        [None, 2 ** 200 + 1, FAILURE],
+        [4, 2 ** 200 + 1, None],
+    ]
+    # Exact uint256 deltas, None where a side is missing or failed
+    assert diff.delta.tolist() == [[None, 1, None], [None, 0, None]]
+    keys, deltas = diff.top_movers()
+    assert keys.tolist() == ["a", "b"]
+    assert deltas.tolist() == [3, 1]
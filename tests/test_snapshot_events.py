@@ -0,0 +1,183 @@
+import pytest
+from eth_abi import decode_single, encode_single
+from eth_utils import function_signature_to_4byte_selector, keccak
+
+import helpers.multicall.call as call_module
+from helpers.multicall import Call, CallFailure, as_wei, func
+from helpers.snapshot.events import EventSourcedSnaps, transfers
+from helpers.snapshot.snap import Snap
+
+"""
+  Event-sourced snaps from stand-in Transfer logs, no node required
+"""
+
+TOKEN = "0x1111111111111111111111111111111111111111"
+SETT = "0x3333333333333333333333333333333333333333"
+MULTICALL = "0x2222222222222222222222222222222222222222"
+USER = "0x00000000000000000000000000000000000000aa"
+OTHER = "0x00000000000000000000000000000000000000bb"
+ZERO = "0x" + "00" * 20
+
+TRANSFER = keccak(text="Transfer(address,address,uint256)")
+APPROVAL = keccak(text="Approval(address,address,uint256)")
+PPFS = function_signature_to_4byte_selector("getPricePerFullShare()")
+
+
+def topic(address):
+    return bytes(12) + bytes.fromhex(address[2:])
+
+
+def transfer(token, sender, receiver, amount):
+    """
+    A log as web3 gives it: HexBytes topics and hex data
+    """
+    return {
+        "address": token,
+        "topics": [TRANSFER, topic(sender), topic(receiver)],
+        "data": "0x{:064x}".format(amount),
+    }
+
+
+class StandInEth:
+    """
+    Answers the calls logs cannot explain, here only getPricePerFullShare
+    """
+
+    def __init__(self, ppfs):
+        self.ppfs = ppfs
+        self.blocks = []
+
+    def call(self, tx, block_identifier=None):
+        (calls,) = decode_single("((address,bytes)[])", tx["data"][4:])
+        assert [calldata[:4] for target, calldata in calls] == [PPFS]
+        self.blocks.append(block_identifier)
+        return encode_single(
+            "(uint256,bytes[])",
+            [block_identifier, [encode_single("(uint256)", [self.ppfs])]],
+        )
+
+
+@pytest.fixture
+def eth(monkeypatch):
+    eth = StandInEth(2 * 10 ** 18)
+    monkeypatch.setattr(call_module, "web3", type("Web3", (), {"eth": eth}))
+    return eth
+
+
+def snap_calls():
+    calls = [
+        Call(token, [func.erc20.balanceOf, holder], [[key, as_wei]])
+        for token, holder, key in [
+            (TOKEN, USER, "balances.want.user"),
+            (TOKEN, SETT, "balances.want.sett"),
+            (SETT, USER, "balances.sett.user"),
+            (SETT, OTHER, "balances.sett.other"),
+        ]
+    ]
+    calls.append(Call(SETT, [func.erc20.totalSupply], [["sett.totalSupply", as_wei]]))
+    calls.append(
+        Call(SETT, [func.sett.getPricePerFullShare], [["sett.pricePerFullShare", None]])
+    )
+    return calls
+
+
+def before_snap(**values):
+    data = {
+        "balances.want.user": 100,
+        "balances.want.sett": 0,
+        "balances.sett.user": 0,
+        "balances.sett.other": 50,
+        "sett.totalSupply": 50,
+        "sett.pricePerFullShare": 10 ** 18,
+    }
+    data.update(values)
+    return Snap(data, 10, ["user", "sett", "other"])
+
+
+def test_transfers_skips_other_logs():
+    logs = [
+        # Addresses come back lowercased
+        {
+            **transfer(USER, USER, SETT, 7),
+            "address": "0x00000000000000000000000000000000000000AA",
+        },
+        # String topics, as some providers return them
+        {
+            "address": SETT,
+            "topics": ["0x" + TRANSFER.hex(), "0x" + topic(ZERO).hex(), topic(USER)],
+            "data": "0x{:064x}".format(3),
+        },
+        {
+            **transfer(TOKEN, USER, SETT, 1),
+            "topics": [APPROVAL, topic(USER), topic(SETT)],
+        },
+        # ERC721 carries the token id as a fourth topic
+        {
+            **transfer(TOKEN, USER, SETT, 0),
+            "topics": [TRANSFER, topic(USER), topic(SETT), bytes(32)],
+        },
+    ]
+    assert list(transfers(logs)) == [
+        (USER, USER, SETT, 7),
+        (SETT, ZERO, USER, 3),
+    ]
+
+
+def test_next_snap_moves_balances_and_supply(eth):
+    events = EventSourcedSnaps(snap_calls(), address=MULTICALL)
+    logs = [
+        # Deposit: want in, shares minted
+        transfer(TOKEN, USER, SETT, 40),
+        transfer(SETT, ZERO, USER, 20),
+        # Shares moved between users, then some burnt
+        transfer(SETT, OTHER, USER, 5),
+        transfer(SETT, USER, ZERO, 10),
+        # Untracked holders and tokens are ignored
+        transfer(TOKEN, SETT, "0x" + "cc" * 20, 1),
+        transfer("0x" + "dd" * 20, USER, SETT, 1000),
+    ]
+    after = events.next_snap(before_snap(), logs, 11)
+
+    assert after.block == 11
+    assert after.data == {
+        "balances.want.user": 60,
+        "balances.want.sett": 39,
+        "balances.sett.user": 15,
+        "balances.sett.other": 45,
+        "sett.totalSupply": 60,
+        "sett.pricePerFullShare": 2 * 10 ** 18,
+    }
+    # Only the values logs cannot explain were read, at the receipt's block
+    assert eth.blocks == [11]
+
+
+def test_next_snap_keeps_failed_reads(eth):
+    events = EventSourcedSnaps(snap_calls(), address=MULTICALL)
+    failure = CallFailure(SETT, func.erc20.totalSupply, "reverted without reason")
+    before = before_snap(**{"sett.totalSupply": failure})
+    after = events.next_snap(before, [transfer(SETT, ZERO, USER, 20)], 11)
+
+    assert after.get("sett.totalSupply") is failure
+    assert after.get("balances.sett.user") == 20
+
+
+def test_due_and_drift(eth):
+    events = EventSourcedSnaps(snap_calls(), verifyEvery=2, address=MULTICALL)
+    before = before_snap()
+    derived = events.next_snap(before, [transfer(TOKEN, USER, SETT, 40)], 11)
+    assert not events.due()
+    derived = events.next_snap(derived, [], 12)
+    assert events.due()
+
+    # A fee-on-transfer token delivered less than logged
+    actual = before_snap(
+        **{
+            "balances.want.user": 60,
+            "balances.want.sett": 39,
+            "sett.pricePerFullShare": 2 * 10 ** 18,
+        }
+    )
+    assert EventSourcedSnaps.drift(derived, actual) == ["balances.want.sett"]
+    assert EventSourcedSnaps.drift(derived, derived) == []
+
+    assert not EventSourcedSnaps(snap_calls(), verifyEvery=0, address=MULTICALL).due()
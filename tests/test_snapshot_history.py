@@ -0,0 +1,109 @@
+from eth_abi import encode_single
+
+from helpers.multicall import Call, func
+from helpers.multicall.plan import CallPlan, LazyValues
+from helpers.snapshot.history import DELTA, KEYFRAME, SnapHistory
+from helpers.snapshot.snap import KeyIndex, Snap
+
+"""
+  SnapHistory keyframes and deltas, no node required
+"""
+
+TOKEN = "0x1111111111111111111111111111111111111111"
+MULTICALL = "0x2222222222222222222222222222222222222222"
+USERS = ["0x{:040x}".format(i) for i in range(1, 4)]
+KEYS = ["sett.balance", "sett.totalSupply", "sett.pricePerFullShare"]
+
+
+def snap(block, row, keys=KEYS):
+    return Snap(dict(zip(keys, row)), block, ["user"])
+
+
+def balance_plan():
+    calls = [
+        Call(TOKEN, [func.erc20.balanceOf, user], [["balances.want." + user, None]])
+        for user in USERS
+    ]
+    return CallPlan(calls, address=MULTICALL)
+
+
+def lazy_snap(plan, block, balances):
+    """
+    A snap as taken with lazySnaps, fields decode from the raw outputs on first read
+    """
+    outputs = [memoryview(encode_single("(uint256)", [value])) for value in balances]
+    return Snap.from_values(
+        KeyIndex.intern(plan.keys), LazyValues(plan, outputs), block, []
+    )
+
+
+def test_rebuild_at_every_offset():
+    history = SnapHistory(keyframeInterval=3)
+    rows = [[i, i // 2, 7] for i in range(10)]
+    for block, row in enumerate(rows):
+        history.put(snap(block, row))
+
+    assert [frame[0] for frame in history.frames] == [KEYFRAME, DELTA, DELTA] * 3 + [
+        KEYFRAME
+    ]
+    for block, row in enumerate(rows):
+        assert history[block].values == row
+    assert history.stored_values() < len(rows) * len(KEYS)
+
+
+def test_key_index_change_starts_a_keyframe():
+    history = SnapHistory(keyframeInterval=8)
+    history.put(snap(1, [1, 2, 3]))
+    history.put(snap(2, [1, 2, 4]))
+    history.put(snap(3, [1, 2, 4, 9], KEYS + ["strategy.balanceOf"]))
+    history.put(snap(4, [1, 3, 4, 9], KEYS + ["strategy.balanceOf"]))
+
+    assert [frame[0] for frame in history.frames] == [KEYFRAME, DELTA, KEYFRAME, DELTA]
+    assert history[2].data == dict(zip(KEYS, [1, 2, 4]))
+    assert history[4].get("strategy.balanceOf") == 9
+    assert history[4].get("sett.totalSupply") == 3
+
+
+def test_save_and_load(tmp_path):
+    history = SnapHistory(keyframeInterval=4)
+    rows = [[i, 5, i * i] for i in range(6)]
+    for block, row in enumerate(rows):
+        history.put(snap(block, row))
+    path = str(tmp_path / "history.json")
+    history.save(path)
+
+    loaded = SnapHistory.load(path)
+    assert loaded.keys() == history.keys()
+    for block, row in enumerate(rows):
+        assert loaded[block].values == row
+        assert loaded[block].entityKeys == ["user"]
+    # Appending after a reload deltas against the last stored snap
+    loaded.put(snap(6, [5, 5, 36]))
+    assert loaded.frames[-1][0] == DELTA
+    assert loaded[6].values == [5, 5, 36]
+
+
+def test_lazy_snaps_delta_encode_from_raw_outputs():
+    plan = balance_plan()
+    history = SnapHistory()
+    snaps = [
+        lazy_snap(plan, 1, [1, 2, 3]),
+        lazy_snap(plan, 2, [1, 5, 3]),
+        lazy_snap(plan, 3, [1, 5, 4]),
+    ]
+    for lazy in snaps:
+        history.put(lazy)
+
+    assert [frame[0] for frame in history.frames] == [KEYFRAME, DELTA, DELTA]
+    # The keyframe decodes every value, a delta only the calls whose output changed
+    assert [lazy.values.decoded() for lazy in snaps] == [3, 1, 1]
+    assert history.stored_values() == 5
+    assert history[2].values == [1, 5, 3]
+    assert history[3].values == [1, 5, 4]
+
+    # Outputs of another plan are not compared, the snap is decoded to diff it
+    other = lazy_snap(balance_plan(), 4, [1, 5, 4])
+    history.put(other)
+    assert history.frames[-1][0] == DELTA
+    assert history.frames[-1][3] == ()
+    assert other.values.decoded() == 3
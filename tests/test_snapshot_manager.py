@@ -0,0 +1,431 @@
+from collections import defaultdict
+
+import pytest
+from eth_abi import decode_single, encode_single
+from eth_utils import function_signature_to_4byte_selector, keccak
+
+import helpers.FleetManager as fleet_module
+import helpers.multicall.call as call_module
+import helpers.multicall.plan as plan_module
+import helpers.SnapshotManager as manager_module
+import helpers.StrategyCoreResolver as resolver_module
+from helpers.fixedpoint import deposit_shares
+from helpers.FleetManager import FleetManager
+from helpers.SnapshotManager import SnapshotManager
+
+"""
+  SnapshotManager against an in-process stand-in vault (want token, sett, strategy and
+  controller), one block mined per transaction, no node required
+"""
+
+WANT, SETT, STRATEGY, CONTROLLER, POOL = [
+    "0x{:040x}".format(i) for i in range(0xA1, 0xA6)
+]
+GOVERNANCE, STRATEGIST, REWARDS, USER = [
+    "0x{:040x}".format(i) for i in range(0xB1, 0xB5)
+]
+GAUGE, TREE, REWARD, NEW_GAUGE, NEW_REWARD = [
+    "0x{:040x}".format(i) for i in range(0xC1, 0xC6)
+]
+# A second vault on the same want token and controller
+SECOND_SETT, SECOND_STRATEGY, SECOND_POOL = [
+    "0x{:040x}".format(i) for i in range(0xD1, 0xD4)
+]
+ZERO = "0x" + "00" * 20
+TRICRYPTO = "triCrypto-Curve-Arbitrum-Rewards"
+
+AGGREGATE = function_signature_to_4byte_selector("aggregate((address,bytes)[])")
+TRY_AGGREGATE = function_signature_to_4byte_selector(
+    "tryAggregate(bool,(address,bytes)[])"
+)
+BALANCE_OF = function_signature_to_4byte_selector("balanceOf(address)")
+TOTAL_SUPPLY = function_signature_to_4byte_selector("totalSupply()")
+TRANSFER = keccak(text="Transfer(address,address,uint256)")
+
+
+def selector(signature):
+    return function_signature_to_4byte_selector(signature)
+
+
+class Account:
+    def __init__(self, address):
+        self.address = address
+
+    def __eq__(self, other):
+        return getattr(other, "address", other).lower() == self.address.lower()
+
+    def __hash__(self):
+        return hash(self.address.lower())
+
+
+class Receipt:
+    """
+    Only what brownie's TransactionReceipt has, notably no block hash
+    """
+
+    __slots__ = ("txid", "block_number", "logs", "status")
+
+    def __init__(self, txid, block_number, logs):
+        self.txid = txid
+        self.block_number = block_number
+        self.logs = logs
+        self.status = 1
+
+
+class StandInChain:
+    """
+    Stands in for web3.eth and brownie's chain: ERC20 balances and supplies, plus the
+    views of every vault on it. Reads answer from the current state whatever the block
+    asked, `salt` changes the hash of every block (a reorg)
+    """
+
+    chainId = 1
+
+    def __init__(self):
+        self.height = 100
+        self.salt = b""
+        self.balances = defaultdict(int)
+        self.supplies = defaultdict(int)
+        # (target, selector) -> (return type, read)
+        self.reads = {}
+        # Calls inside each aggregate sent, block hashes asked for
+        self.batches = []
+        self.hashReads = 0
+        self.transactions = 0
+
+    def view(self, target, data):
+        target = target.lower()
+        if data[:4] == BALANCE_OF:
+            (holder,) = decode_single("(address)", data[4:])
+            return encode_single("(uint256)", [self.balances[(target, holder.lower())]])
+        if data[:4] == TOTAL_SUPPLY:
+            return encode_single("(uint256)", [self.supplies[target]])
+        abi, read = self.reads[(target, bytes(data[:4]))]
+        return encode_single("({})".format(abi), [read()])
+
+    # ===== web3.eth =====
+
+    @property
+    def blockNumber(self):
+        return self.height
+
+    def get_block(self, block):
+        self.hashReads += 1
+        return {"number": block, "hash": keccak(block.to_bytes(32, "big") + self.salt)}
+
+    def call(self, tx, block_identifier=None):
+        data = tx["data"]
+        block = self.height if block_identifier is None else block_identifier
+        if data[:4] == AGGREGATE:
+            (calls,) = decode_single("((address,bytes)[])", data[4:])
+            self.batches.append(len(calls))
+            outputs = [self.view(target, calldata) for target, calldata in calls]
+            return encode_single("(uint256,bytes[])", [block, outputs])
+        requireSuccess, calls = decode_single("(bool,(address,bytes)[])", data[4:])
+        self.batches.append(len(calls))
+        results = []
+        for target, calldata in calls:
+            try:
+                results.append((True, self.view(target, calldata)))
+            except KeyError:
+                results.append((False, b""))
+        if data[:4] == TRY_AGGREGATE:
+            return encode_single("((bool,bytes)[])", [results])
+        blockHash = self.get_block(block)["hash"]
+        self.hashReads -= 1
+        return encode_single(
+            "(uint256,bytes32,(bool,bytes)[])", [block, blockHash, results]
+        )
+
+    # ===== Transactions =====
+
+    def transfer(self, logs, token, sender, receiver, amount):
+        if sender == ZERO:
+            self.supplies[token] += amount
+        else:
+            self.balances[(token, sender)] -= amount
+        if receiver == ZERO:
+            self.supplies[token] -= amount
+        else:
+            self.balances[(token, receiver)] += amount
+        logs.append(
+            {
+                "address": token,
+                "topics": [
+                    TRANSFER,
+                    bytes(12) + bytes.fromhex(sender[2:]),
+                    bytes(12) + bytes.fromhex(receiver[2:]),
+                ],
+                "data": "0x{:064x}".format(amount),
+            }
+        )
+
+    def mine(self, logs):
+        self.height += 1
+        self.transactions += 1
+        return Receipt("0x{:064x}".format(self.transactions), self.height, logs)
+
+
+class StandInVault:
+    """
+    A sett, its strategy and controller on `chain`, the strategy deposits all its want
+    into `pool`
+    """
+
+    def __init__(
+        self,
+        chain,
+        sett=SETT,
+        strategy=STRATEGY,
+        controller=CONTROLLER,
+        pool=POOL,
+        name="StandIn-Strategy",
+    ):
+        self.chain = chain
+        self.sett = sett
+        self.strategy = strategy
+        self.controller = controller
+        self.pool = pool
+        self.name = name
+        # Addresses the strategy resolver reads once and caches
+        self.metadata = {"gauge": GAUGE, "badgerTree": TREE, "reward": REWARD}
+        balances = chain.balances
+        chain.reads.update(
+            {
+                (sett, selector("token()")): ("address", lambda: WANT),
+                (sett, selector("balance()")): ("uint256", self.sett_balance),
+                (sett, selector("available()")): (
+                    "uint256",
+                    lambda: balances[(WANT, sett)],
+                ),
+                (sett, selector("getPricePerFullShare()")): (
+                    "uint256",
+                    lambda: 10 ** 18,
+                ),
+                (strategy, selector("want()")): ("address", lambda: WANT),
+                (strategy, selector("getName()")): ("string", lambda: self.name),
+                (strategy, selector("governance()")): ("address", lambda: GOVERNANCE),
+                (strategy, selector("strategist()")): ("address", lambda: STRATEGIST),
+                (strategy, selector("balanceOfPool()")): (
+                    "uint256",
+                    lambda: balances[(WANT, pool)],
+                ),
+                (strategy, selector("balanceOfWant()")): (
+                    "uint256",
+                    lambda: balances[(WANT, strategy)],
+                ),
+                (strategy, selector("balanceOf()")): (
+                    "uint256",
+                    self.strategy_balance,
+                ),
+                (strategy, selector("withdrawalFee()")): ("uint256", lambda: 50),
+                (strategy, selector("performanceFeeGovernance()")): (
+                    "uint256",
+                    lambda: 0,
+                ),
+                (strategy, selector("performanceFeeStrategist()")): (
+                    "uint256",
+                    lambda: 0,
+                ),
+                (controller, selector("rewards()")): ("address", lambda: REWARDS),
+                **{
+                    (strategy, selector(name + "()")): (
+                        "address",
+                        lambda name=name: self.metadata[name],
+                    )
+                    for name in self.metadata
+                },
+            }
+        )
+
+    def strategy_balance(self):
+        balances = self.chain.balances
+        return balances[(WANT, self.strategy)] + balances[(WANT, self.pool)]
+
+    def sett_balance(self):
+        return self.chain.balances[(WANT, self.sett)] + self.strategy_balance()
+
+    def deposit(self, amount, overrides):
+        chain = self.chain
+        user = overrides["from"].address.lower()
+        shares = deposit_shares(amount, self.sett_balance(), chain.supplies[self.sett])
+        logs = []
+        chain.transfer(logs, WANT, user, self.sett, amount)
+        chain.transfer(logs, self.sett, ZERO, user, shares)
+        return chain.mine(logs)
+
+    def earn(self, overrides):
+        chain = self.chain
+        available = chain.balances[(WANT, self.sett)]
+        logs = []
+        chain.transfer(logs, WANT, self.sett, self.strategy, available)
+        chain.transfer(logs, WANT, self.strategy, self.pool, available)
+        return chain.mine(logs)
+
+    def contracts(self):
+        """
+        (sett, strategy, controller) as SnapshotManager takes them
+        """
+        sett = Contract(self.sett, token=unread, deposit=self.deposit, earn=self.earn)
+        strategy = Contract(
+            self.strategy,
+            getName=unread,
+            version=unread,
+            want=unread,
+            governance=unread,
+            strategist=unread,
+        )
+        return sett, strategy, Contract(self.controller, rewards=unread)
+
+
+def unread(*args):
+    raise AssertionError("read outside the init-time multicall")
+
+
+class Contract(Account):
+    def __init__(self, address, **methods):
+        super().__init__(address)
+        self.__dict__.update(methods)
+
+
+@pytest.fixture
+def chain(monkeypatch):
+    chain = StandInChain()
+    web3 = type("Web3", (), {"eth": chain})
+    interface = type("Interface", (), {"IERC20": staticmethod(Account)})
+    for module in (call_module, plan_module, manager_module):
+        monkeypatch.setattr(module, "web3", web3)
+    for module in (manager_module, resolver_module, fleet_module):
+        monkeypatch.setattr(module, "chain", chain)
+    for module in (manager_module, resolver_module):
+        monkeypatch.setattr(module, "interface", interface)
+    chain.balances[(WANT, USER)] = 1000 * 10 ** 18
+    return chain
+
+
+@pytest.fixture
+def vault(chain):
+    return StandInVault(chain)
+
+
+def manager(vault, **options):
+    manager = SnapshotManager(*vault.contracts(), "vault")
+    for name, value in options.items():
+        setattr(manager, name, value)
+    return manager
+
+
+@pytest.mark.parametrize("eventSourced", [False, True])
+def test_sequence_reuses_the_after_snap(chain, vault, eventSourced):
+    snap = manager(vault, eventSourced=eventSourced)
+    user = Account(USER)
+    with snap.sequence():
+        snap.settDeposit(10 ** 18, {"from": user})
+        snap.settEarn({"from": user})
+        snap.settDeposit(10 ** 18, {"from": user})
+    # The earn and the second deposit started from the previous step's after-snap
+    assert chain.hashReads == 2
+    assert len(snap.snaps) == 4
+    assert snap.boundary is None
+
+    latest = snap.snaps[chain.height]
+    assert latest.balances("want", "user") == 998 * 10 ** 18
+    assert latest.balances("sett", "user") == 2 * 10 ** 18
+    assert latest.get("strategy.balanceOfPool") == 10 ** 18
+
+
+def test_sequence_reads_again_after_a_reorg(chain, vault):
+    snap = manager(vault)
+    trackedUsers = {"user": USER}
+    with snap.sequence():
+        first = snap.snap(trackedUsers)
+        assert snap.snap(trackedUsers) is first
+        chain.salt = b"reorg"
+        reread = snap.snap(trackedUsers)
+        assert reread is not first
+        assert snap.snap(trackedUsers) is reread
+    assert len(chain.batches) == 3
+
+
+def test_sequence_checks_the_hash_read_with_the_snap(chain, vault):
+    snap = manager(
+        vault, multicallOptions={"require_success": False, "with_block": True}
+    )
+    trackedUsers = {"user": USER}
+    with snap.sequence():
+        first = snap.snap(trackedUsers)
+        chain.salt = b"reorg"
+        assert snap.snap(trackedUsers) is not first
+    assert len(chain.batches) == 3
+
+
+def test_snaps_outside_a_sequence_are_not_reused(chain, vault):
+    snap = manager(vault)
+    snap.snap({"user": USER})
+    snap.snap({"user": USER})
+    assert chain.hashReads == 0
+    assert len(chain.batches) == 3
+
+
+def test_expired_metadata_recompiles_the_plan(chain, vault):
+    vault.name = TRICRYPTO
+    chain.balances[(REWARD, USER)] = 1
+    chain.balances[(NEW_REWARD, USER)] = 2
+    snap = manager(vault)
+    snap.resolver.metadataTTL = 10
+    trackedUsers = {"user": USER}
+    assert snap.snap(trackedUsers).get("balances.reward.user") == 1
+
+    vault.metadata["reward"] = NEW_REWARD
+    chain.height += 9
+    assert snap.snap(trackedUsers).get("balances.reward.user") == 1
+    chain.height += 1
+    assert snap.snap(trackedUsers).get("balances.reward.user") == 2
+
+
+def test_moved_gauge_recompiles_the_plan(chain, vault):
+    vault.name = TRICRYPTO
+    chain.balances[(REWARD, USER)] = 1
+    chain.balances[(NEW_REWARD, USER)] = 2
+    snap = manager(vault)
+    trackedUsers = {"user": USER}
+    snap.snap(trackedUsers)
+
+    vault.metadata.update(gauge=NEW_GAUGE, reward=NEW_REWARD)
+    moved = snap.snap(trackedUsers)
+    assert moved.get("strategy.gauge") == int(NEW_GAUGE, 16)
+    assert moved.get("balances.reward.user") == 1
+    assert snap.entities["gauge"].lower() == NEW_GAUGE
+    assert snap.snap(trackedUsers).get("balances.reward.user") == 2
+
+
+def test_fleet_splits_the_merged_snap_per_vault(chain, vault):
+    second = StandInVault(
+        chain, SECOND_SETT, SECOND_STRATEGY, CONTROLLER, SECOND_POOL, TRICRYPTO
+    )
+    user = Account(USER)
+    vault.deposit(10 ** 18, {"from": user})
+    vault.earn({"from": user})
+    second.deposit(3 * 10 ** 18, {"from": user})
+    chain.balances[(WANT, GOVERNANCE)] = 7
+
+    fleet = FleetManager({"first": vault.contracts(), "second": second.contracts()})
+    snaps = fleet.snap()
+    # Both vaults read the want balances of the same governance, controller...
+    assert fleet.get_plan().saved > 0
+    for key, standIn in [("first", vault), ("second", second)]:
+        alone = SnapshotManager(*standIn.contracts(), key).snap()
+        assert snaps[key].data == alone.data
+        assert snaps[key].entityKeys == alone.entityKeys
+        assert fleet[key].snaps[chain.height].data == alone.data
+    assert snaps["first"].get("strategy.balanceOfPool") == 10 ** 18
+    assert snaps["second"].get("sett.available") == 3 * 10 ** 18
+    assert "balances.reward.gauge" in snaps["second"].index
+    assert snaps["first"].balances("want", "governance") == 7
+    assert snaps["second"].balances("want", "governance") == 7
+
+    # A moved gauge is picked up by the merged plan on the next snap
+    second.metadata["gauge"] = NEW_GAUGE
+    chain.balances[(WANT, NEW_GAUGE)] = 5
+    fleet.snap()
+    assert fleet.snap()["second"].balances("want", "gauge") == 5
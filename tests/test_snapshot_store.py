@@ -0,0 +1,96 @@
+import os
+
+import pytest
+
+from helpers.multicall import CallFailure
+from helpers.snapshot.snap import Snap
+from helpers.snapshot.store import (
+    WORD,
+    ColumnarSnapStore,
+    JsonLinesSnapStore,
+    SqliteSnapStore,
+)
+
+"""
+  Persistent snap stores: reopen, range queries and column export
+"""
+
+KEYS = ["sett.balance", "sett.pricePerFullShare"]
+
+
+def snap(block, balance):
+    # uint256 values past float64 precision must come back exact
+    return Snap(dict(zip(KEYS, [balance, 10 ** 18 + 2 ** 80 + block])), block, ["u"])
+
+
+def open_store(kind, tmp_path):
+    if kind == "columnar":
+        return ColumnarSnapStore(str(tmp_path / "columns"))
+    if kind == "sqlite":
+        return SqliteSnapStore(str(tmp_path / "snaps.db"))
+    return JsonLinesSnapStore(str(tmp_path / "snaps.jsonl"))
+
+
+@pytest.mark.parametrize("kind", ["columnar", "sqlite", "jsonl"])
+def test_round_trip_after_reopen(kind, tmp_path):
+    store = open_store(kind, tmp_path)
+    for block in [30, 10, 20]:
+        store.put(snap(block, block * 2))
+
+    store = open_store(kind, tmp_path)
+    assert store.blocks() == [10, 20, 30]
+    assert 20 in store and 15 not in store
+    assert store.get(20).data == snap(20, 40).data
+    assert store.get(20).entityKeys == ["u"]
+    assert [s.block for s in store.between(15, 30)] == [20, 30]
+
+    blocks, values = store.column("sett.pricePerFullShare", 20)
+    assert blocks.tolist() == [20, 30]
+    assert values.tolist() == [10 ** 18 + 2 ** 80 + 20, 10 ** 18 + 2 ** 80 + 30]
+
+
+@pytest.mark.parametrize("kind", ["sqlite", "jsonl"])
+def test_failed_reads_are_stored_as_null(kind, tmp_path):
+    failure = CallFailure(KEYS[0], "balance()(uint256)", "reverted without reason")
+    store = open_store(kind, tmp_path)
+    store.put(Snap(dict(zip(KEYS, [failure, 10 ** 18])), 1, ["u"]))
+
+    store = open_store(kind, tmp_path)
+    assert store.get(1).data == {
+        "sett.balance": None,
+        "sett.pricePerFullShare": 10 ** 18,
+    }
+
+
+def test_columnar_drops_a_torn_row(tmp_path):
+    store = open_store("columnar", tmp_path)
+    store.put(snap(1, 2))
+    store.put(snap(2, 4))
+    # A crash after the first column was written but before the block
+    with open(store.path(0), "ab") as f:
+        f.write((6).to_bytes(WORD, "big"))
+
+    store = open_store("columnar", tmp_path)
+    assert store.blocks() == [1, 2]
+    assert os.path.getsize(store.path(0)) == 2 * WORD
+    store.put(snap(3, 6))
+    assert store.column("sett.balance")[1].tolist() == [2, 4, 6]
+    assert store.column("sett.balance", dtype=float)[1].tolist() == [2.0, 4.0, 6.0]
+
+
+def test_columnar_reopens_after_a_failed_first_put(tmp_path):
+    store = open_store("columnar", tmp_path)
+    with pytest.raises(TypeError):
+        store.put(Snap(dict(zip(KEYS, [None, 1])), 1, ["u"]))
+    assert not os.path.exists(store.meta)
+
+    store = open_store("columnar", tmp_path)
+    store.put(snap(1, 2))
+    # A crash after keys.json but before any column or block was written
+    os.remove(store.path("blocks"))
+    os.remove(store.path(1))
+
+    store = open_store("columnar", tmp_path)
+    assert store.blocks() == []
+    store.put(snap(2, 4))
+    assert store.column("sett.balance")[1].tolist() == [4]
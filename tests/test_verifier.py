@@ -0,0 +1,88 @@
+import pytest
+
+from helpers.invariants import After, Before, Param, Rule, RuleSet
+from helpers.snapshot.snap import Snap
+from helpers.verifier import BatchVerifier, Transition
+
+RULES = {
+    "deposit": RuleSet(
+        Rule(
+            "user pays",
+            After.balances("want", "user")
+            == Before.balances("want", "user") - Param("amount"),
+        ),
+        Rule(
+            "supply grows",
+            After("sett.totalSupply") > Before("sett.totalSupply"),
+            when=Param("amount") > 0,
+        ),
+    ),
+    "earn": RuleSet(
+        Rule(
+            "pool grows",
+            After("strategy.balanceOfPool") >= Before("strategy.balanceOfPool"),
+        )
+    ),
+}
+
+
+def snap(block, user, supply, pool=0):
+    return Snap(
+        {
+            "balances.want.user": user,
+            "sett.totalSupply": supply,
+            "strategy.balanceOfPool": pool,
+        },
+        block,
+        ["user"],
+    )
+
+
+def transitions():
+    found = []
+    for block in range(0, 40, 2):
+        # Every fifth deposit takes too much, every seventh mints nothing
+        paid = 11 if block % 5 == 0 else 10
+        minted = 0 if block % 7 == 0 else 10
+        found.append(
+            Transition(
+                "deposit",
+                snap(block, 100, 50),
+                snap(block + 1, 100 - paid, 50 + minted),
+                {"amount": 10},
+                "0x{:064x}".format(block),
+            )
+        )
+    # A snap without the pool breaks its chunk's vectorized pass
+    broken = Snap({"balances.want.user": 1}, 101, ["user"])
+    found.append(Transition("earn", snap(100, 1, 1, 5), broken))
+    found.append(Transition("earn", snap(102, 1, 1, 5), snap(103, 1, 1, 4)))
+    found.append(Transition("earn", snap(104, 1, 1, 5), snap(105, 1, 1, 6)))
+    found.append(Transition("migrate", snap(106, 1, 1), snap(107, 1, 1)))
+    return found
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_failures_are_collected(workers):
+    report = BatchVerifier(RULES, workers=workers, chunksize=4).verify(transitions())
+
+    assert report.total == 24
+    assert not report.ok
+    failed = {(f["action"], f["rule"], f["before"]) for f in report.failures}
+    assert failed == {
+        *(("deposit", "user pays", block) for block in [0, 10, 20, 30]),
+        *(("deposit", "supply grows", block) for block in [0, 14, 28]),
+        ("earn", "pool grows", 100),
+        ("earn", "pool grows", 102),
+        ("migrate", "unknown action", 106),
+    }
+    errors = [f for f in report.failures if f["error"]]
+    assert [f["before"] for f in errors] == [100]
+    assert report.failed_transitions() == 9
+    assert "9 failed" in report.summary()
+
+
+def test_workers_agree():
+    single = BatchVerifier(RULES, workers=1, chunksize=4).verify(transitions())
+    pooled = BatchVerifier(RULES, workers=3, chunksize=4).verify(transitions())
+    assert pooled.failures == single.failures